@@ -55,8 +55,9 @@ options:
     choices: []
   server_name:
     description:
-      - slb server name
-    required: true
+      - slb server name. Required unless C(servers) is used, or the task
+        only flushes the configuration with C(flush_config).
+    required: false
     default: null
     aliases: ['server']
     choices: []
@@ -91,6 +92,59 @@ options:
     default: present
     aliases: []
     choices: ['present', 'absent']
+  servers:
+    description:
+      - A list of slb servers to manage in one aXAPI session, instead of
+        C(server_name). Each list item is a dictionary with the C(server_name:)
+        and optionally the C(server_ip:), C(server_status:) and C(server_ports:)
+        of a server, which default to the module level values. All servers
+        are read with one call, and the configuration is written at most
+        once at the end.
+    required: false
+    default: null
+    aliases: []
+    choices: []
+    version_added: 2.0
+  session_cache:
+    description:
+      - Path of a file on the executing host in which the aXAPI session id is
+        stored. The a10 modules share it, and tasks within C(session_ttl)
+        seconds reuse the session instead of authenticating and closing a new
+        one. A session the device has dropped is replaced transparently.
+        The file is only readable by its owner.
+    required: false
+    default: null
+    aliases: []
+    choices: []
+    version_added: 2.0
+  session_ttl:
+    description:
+      - Number of seconds a cached session id is reused for.
+    required: false
+    default: 600
+    aliases: []
+    choices: []
+    version_added: 2.0
+  deferred_write:
+    description:
+      - Path of a file on the executing host in which devices with unsaved
+        configuration changes are recorded. When set, C(write_config) only
+        marks the device there, and the configuration is written to memory
+        once by a later task with C(flush_config).
+    required: false
+    default: null
+    aliases: []
+    choices: []
+    version_added: 2.0
+  flush_config:
+    description:
+      - If C(yes), write the configuration to memory when the device is marked
+        in C(deferred_write), and clear the mark. The object options may be
+        left out to only flush.
+    required: false
+    default: "no"
+    choices: ["yes", "no"]
+    version_added: 2.0
 '''
 
 EXAMPLES = '''
@@ -107,12 +161,216 @@ EXAMPLES = '''
       - port_num: 8443
         protocol: TCP
 
+# Create or update several servers in one session
+- a10_server:
+    host: a10.mydomain.com
+    username: myadmin
+    password: mypassword
+    write_config: yes
+    servers:
+      - server_name: web1
+        server_ip: 1.1.1.101
+        server_ports:
+          - port_num: 80
+            protocol: tcp
+      - server_name: web2
+        server_ip: 1.1.1.102
+        server_status: disabled
+        server_ports:
+          - port_num: 80
+            protocol: tcp
+
+# Save the configuration once at the end of the play
+- a10_server:
+    host: a10.mydomain.com
+    username: myadmin
+    password: mypassword
+    session_cache: ~/.ansible/a10_sessions.json
+    deferred_write: ~/.ansible/a10_unsaved.json
+    flush_config: yes
+
 '''
 
+import fcntl
+import os
+import tempfile
+import time
+
 VALID_PORT_FIELDS = ['port_num', 'protocol', 'status']
 
+# aXAPI error code of a session id the device does not know (anymore)
+AXAPI_INVALID_SESSION = 1009
+
+def write_json_file(path, data):
+    # write to a unique temporary file in the same directory first, so
+    # readers never see partial content; mkstemp creates it with mode 0600
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        f = os.fdopen(fd, 'w')
+        try:
+            json.dump(data, f)
+        finally:
+            f.close()
+        os.rename(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+def load_json_file(path):
+    if not os.path.exists(path):
+        return {}
+    try:
+        return json.load(open(path))
+    except ValueError:
+        return {}
+
+def update_json_file(path, update):
+    '''
+    Applies update to the content of the file while holding an exclusive
+    lock, as the forks of a play share the file. The lock is taken on a
+    separate file, since writing replaces the file itself.
+    '''
+    lock_fd = os.open(path + '.lock', os.O_WRONLY | os.O_CREAT, 0600)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        data = load_json_file(path)
+        update(data)
+        write_json_file(path, data)
+    finally:
+        os.close(lock_fd)
+
+def load_session_id(path, host, username, ttl):
+    # returns the cached session id, and whether it is younger than ttl
+    entry = load_json_file(path).get("%s@%s" % (username, host))
+    if not entry:
+        return (None, False)
+    return (entry['id'], time.time() - entry['time'] < ttl)
+
+def save_session_id(path, host, username, session_id):
+    def update(sessions):
+        sessions["%s@%s" % (username, host)] = {'id': session_id,
+                                                'time': time.time()}
+    update_json_file(path, update)
+
+def config_dirty(path, host):
+    # returns when the device was marked dirty, or None
+    return load_json_file(path).get(host)
+
+def set_config_dirty(path, host):
+    def update(hosts):
+        hosts[host] = time.time()
+    update_json_file(path, update)
+
+def clear_config_dirty(path, host, marked):
+    # keep the mark if another task set it again meanwhile
+    def update(hosts):
+        if hosts.get(host) == marked:
+            del hosts[host]
+    update_json_file(path, update)
+
+def axapi_session_invalid(result):
+    return axapi_failure(result) and \
+        result['response'].get('err', {}).get('code') == AXAPI_INVALID_SESSION
+
+def axapi_new_session(module, session):
+    session['url'] = axapi_authenticate(module, session['base_url'],
+                                        session['username'], session['password'])
+    session['cached'] = False
+    if session['cache']:
+        save_session_id(session['cache'], session['host'], session['username'],
+                        session['url'].split('&session_id=')[-1])
+
+def axapi_open_session(module, host, base_url, username, password,
+                       session_cache=None, session_ttl=0):
+    '''
+    Returns a session, reusing the session id cached in session_cache
+    when it is younger than session_ttl seconds.
+    '''
+    session = {'host': host, 'base_url': base_url, 'username': username,
+               'password': password, 'cache': session_cache, 'cached': False}
+    session_id, fresh = (None, False)
+    if session_cache:
+        session_id, fresh = load_session_id(session_cache, host, username,
+                                             session_ttl)
+    if session_id and fresh:
+        session['url'] = '%s&session_id=%s' % (base_url, session_id)
+        session['cached'] = True
+    else:
+        if session_id:
+            # close the expired session rather than leaving it open on the
+            # device until its idle timeout; the result does not matter, it
+            # may already be gone
+            axapi_call(module, '%s&session_id=%s&method=session.close' %
+                       (base_url, session_id))
+        axapi_new_session(module, session)
+    return session
+
+def axapi_session_call(module, session, method, post=None):
+    result = axapi_call(module, '%s&method=%s' % (session['url'], method), post)
+    if session['cached'] and axapi_session_invalid(result):
+        # the device dropped the cached session, e.g. after its idle timeout
+        axapi_new_session(module, session)
+        result = axapi_call(module, '%s&method=%s' % (session['url'], method), post)
+    return result
+
+def axapi_close_session(module, session):
+    # a cached session is left open for the following tasks
+    if not session['cache']:
+        axapi_session_call(module, session, 'session.close')
+
+def axapi_save_config(module, session, changed, write_config, deferred_write,
+                      flush_config):
+    '''
+    Writes the configuration to memory when it changed and write_config is
+    set. With deferred_write the device is only marked dirty, and a later
+    task with flush_config writes it once. Returns whether it was written.
+    '''
+    host = session['host']
+    save = changed and write_config
+    if save and deferred_write:
+        set_config_dirty(deferred_write, host)
+        save = False
+    marked = None
+    if flush_config:
+        marked = config_dirty(deferred_write, host)
+        if marked is not None:
+            save = True
+    if not save:
+        return False
+    write_result = axapi_session_call(module, session, 'system.action.write_memory')
+    if axapi_failure(write_result):
+        module.fail_json(msg="failed to save the configuration: %s" % write_result['response']['err']['msg'])
+    if marked is not None:
+        clear_config_dirty(deferred_write, host, marked)
+    return True
+
+def axapi_flush_only(module, host, base_url, username, password, session_cache,
+                     session_ttl, deferred_write):
+    # a task without an object only writes the changes recorded earlier
+    session = axapi_open_session(module, host, base_url, username, password,
+                                 session_cache, session_ttl)
+    saved = axapi_save_config(module, session, False, False, deferred_write, True)
+    axapi_close_session(module, session)
+    if saved:
+        result = dict(msg="the configuration was written to memory")
+    else:
+        result = dict(msg="there were no unsaved changes")
+    module.exit_json(changed=saved, content=result)
+
 def validate_ports(module, ports):
+    '''
+    Validates the port definitions and returns normalized copies of them,
+    leaving the given definitions untouched.
+    '''
+    if not isinstance(ports, list):
+        module.fail_json(msg="server_ports must be a list of port definitions")
+    validated = []
     for item in ports:
+        if not isinstance(item, dict):
+            module.fail_json(msg="port definitions must be dictionaries with the fields: %s" % ','.join(VALID_PORT_FIELDS))
+        item = dict(item)
+        validated.append(item)
+
         for key in item:
             if key not in VALID_PORT_FIELDS:
                 module.fail_json(msg="invalid port field (%s), must be one of: %s" % (key, ','.join(VALID_PORT_FIELDS)))
@@ -143,6 +401,73 @@ def validate_ports(module, ports):
         else:
             item['status'] = 1
 
+    return validated
+
+def ports_differ(src_ports, dst_ports):
+    '''
+    Checks whether the port definitions of src_ports and dst_ports
+    differ, by indexing dst_ports on their port number. Ports missing
+    from either list count as a difference.
+    '''
+    if len(src_ports) != len(dst_ports):
+        return True
+    dst_index = dict((port['port_num'], port) for port in dst_ports)
+    for src_port in src_ports:
+        dst_port = dst_index.get(src_port['port_num'])
+        if dst_port is None:
+            return True
+        for valid_field in VALID_PORT_FIELDS:
+            if src_port.get(valid_field) != dst_port.get(valid_field):
+                return True
+    # every port from the src exists in the dst, and none of them were different
+    return False
+
+def manage_server(module, session, state, slb_server, slb_server_ip,
+                  slb_server_status, slb_server_ports, slb_server_data):
+    '''
+    Creates, updates or deletes one slb server, given its current
+    definition on the device (None when it does not exist). Returns
+    whether anything was changed, and the result of the last call.
+    '''
+    json_post = {
+        'server': {
+            'name': slb_server,
+            'host': slb_server_ip,
+            'status': axapi_enabled_disabled(slb_server_status),
+            'port_list': slb_server_ports,
+        }
+    }
+
+    changed = False
+    result = None
+    if state == 'present':
+        if not slb_server_ip:
+            module.fail_json(msg='you must specify an IP address when creating a server')
+
+        if slb_server_data is None:
+            result = axapi_session_call(module, session, 'slb.server.create', json.dumps(json_post))
+            if axapi_failure(result):
+                module.fail_json(msg="failed to create the server: %s" % result['response']['err']['msg'])
+            changed = True
+        else:
+            defined_ports = slb_server_data.get('port_list', [])
+
+            if ports_differ(slb_server_ports, defined_ports):
+                result = axapi_session_call(module, session, 'slb.server.update', json.dumps(json_post))
+                if axapi_failure(result):
+                    module.fail_json(msg="failed to update the server: %s" % result['response']['err']['msg'])
+                changed = True
+    elif state == 'absent':
+        if slb_server_data is not None:
+            result = axapi_session_call(module, session, 'slb.server.delete', json.dumps({'name': slb_server}))
+            changed = True
+    return (changed, result)
+
+def get_all_servers(module, session):
+    result = axapi_session_call(module, session, 'slb.server.getAll')
+    if axapi_failure(result):
+        module.fail_json(msg="failed to read the servers: %s" % result['response']['err']['msg'])
+    return dict((server['name'], server) for server in result.get('server_list', []))
 
 def main():
     argument_spec = a10_argument_spec()
@@ -150,15 +475,21 @@ def main():
     argument_spec.update(
         dict(
             state=dict(type='str', default='present', choices=['present', 'absent']),
-            server_name=dict(type='str', aliases=['server'], required=True),
+            server_name=dict(type='str', aliases=['server']),
             server_ip=dict(type='str', aliases=['ip', 'address']),
             server_status=dict(type='str', default='enabled', aliases=['status'], choices=['enabled', 'disabled']),
             server_ports=dict(type='list', aliases=['port'], default=[]),
+            servers=dict(type='list'),
+            session_cache=dict(type='str'),
+            session_ttl=dict(type='int', default=600),
+            deferred_write=dict(type='str'),
+            flush_config=dict(type='bool', default=False),
         )
     )
 
     module = AnsibleModule(
         argument_spec=argument_spec,
+        mutually_exclusive=[['servers', 'server_name']],
         supports_check_mode=False
     )
 
@@ -167,99 +498,105 @@ def main():
     password = module.params['password']
     state = module.params['state']
     write_config = module.params['write_config']
+    session_cache = module.params['session_cache']
+    session_ttl = module.params['session_ttl']
+    deferred_write = module.params['deferred_write']
+    flush_config = module.params['flush_config']
     slb_server = module.params['server_name']
     slb_server_ip = module.params['server_ip']
     slb_server_status = module.params['server_status']
     slb_server_ports = module.params['server_ports']
+    slb_servers = module.params['servers']
 
-    if slb_server is None:
-        module.fail_json(msg='server_name is required')
+    if session_cache:
+        session_cache = os.path.expanduser(session_cache)
+    if deferred_write:
+        deferred_write = os.path.expanduser(deferred_write)
+    if flush_config and not deferred_write:
+        module.fail_json(msg='flush_config requires deferred_write')
 
     axapi_base_url = 'https://%s/services/rest/V2.1/?format=json' % host
-    session_url = axapi_authenticate(module, axapi_base_url, username, password)
 
-    # validate the ports data structure
-    validate_ports(module, slb_server_ports)
+    if flush_config and slb_server is None and not slb_servers:
+        axapi_flush_only(module, host, axapi_base_url, username, password,
+                         session_cache, session_ttl, deferred_write)
 
-    json_post = {
-        'server': {
-            'name': slb_server, 
-            'host': slb_server_ip, 
-            'status': axapi_enabled_disabled(slb_server_status),
-            'port_list': slb_server_ports,
-        }
-    }
+    if slb_server is None and not slb_servers:
+        module.fail_json(msg='server_name or servers is required')
 
-    slb_server_data = axapi_call(module, session_url + '&method=slb.server.search', json.dumps({'name': slb_server}))
-    slb_server_exists = not axapi_failure(slb_server_data)
+    # every item of servers overrides the module level values
+    servers = []
+    for item in slb_servers or []:
+        if not isinstance(item, dict) or not item.get('server_name'):
+            module.fail_json(msg='each item of servers must define the server_name field')
+        server = {
+            'server_name': item['server_name'],
+            'server_ip': item.get('server_ip', slb_server_ip),
+            'server_status': item.get('server_status', slb_server_status),
+            'server_ports': item.get('server_ports', slb_server_ports),
+        }
+        if server['server_status'] not in ('enabled', 'disabled'):
+            module.fail_json(msg='server_status must be one of: enabled,disabled')
+        # checked here rather than in manage_server, which would fail after
+        # the earlier items have already been applied
+        if state == 'present' and not server['server_ip']:
+            module.fail_json(msg='you must specify an IP address for server %s' % server['server_name'])
+        # validate the ports data structure
+        server['server_ports'] = validate_ports(module, server['server_ports'])
+        servers.append(server)
+    if not servers:
+        slb_server_ports = validate_ports(module, slb_server_ports)
 
-    changed = False
-    if state == 'present':
-        if not slb_server_ip:
-            module.fail_json(msg='you must specify an IP address when creating a server')
+    session = axapi_open_session(module, host, axapi_base_url, username, password,
+                                 session_cache, session_ttl)
 
-        if not slb_server_exists:
-            result = axapi_call(module, session_url + '&method=slb.server.create', json.dumps(json_post))
-            if axapi_failure(result):
-                module.fail_json(msg="failed to create the server: %s" % result['response']['err']['msg'])
-            changed = True
-        else:
-            def needs_update(src_ports, dst_ports):
-                '''
-                Checks to determine if the port definitions of the src_ports
-                array are in or different from those in dst_ports. If there is
-                a difference, this function returns true, otherwise false.
-                '''
-                for src_port in src_ports:
-                    found = False
-                    different = False
-                    for dst_port in dst_ports:
-                        if src_port['port_num'] == dst_port['port_num']:
-                            found = True
-                            for valid_field in VALID_PORT_FIELDS:
-                                if src_port[valid_field] != dst_port[valid_field]:
-                                    different = True
-                                    break
-                            if found or different:
-                                break
-                    if not found or different:
-                        return True
-                # every port from the src exists in the dst, and none of them were different
-                return False
-
-            defined_ports = slb_server_data.get('server', {}).get('port_list', [])
-
-            # we check for a needed update both ways, in case ports
-            # are missing from either the ones specified by the user
-            # or from those on the device
-            if needs_update(defined_ports, slb_server_ports) or needs_update(slb_server_ports, defined_ports):
-                result = axapi_call(module, session_url + '&method=slb.server.update', json.dumps(json_post))
-                if axapi_failure(result):
-                    module.fail_json(msg="failed to update the server: %s" % result['response']['err']['msg'])
-                changed = True
+    if servers:
+        # one call reads every server, instead of one search per server
+        defined_servers = get_all_servers(module, session)
+        changed = False
+        for server in servers:
+            server_changed, result = manage_server(module, session, state,
+                                                   server['server_name'],
+                                                   server['server_ip'],
+                                                   server['server_status'],
+                                                   server['server_ports'],
+                                                   defined_servers.get(server['server_name']))
+            changed |= server_changed
 
         # if we changed things, get the full info regarding
-        # the service group for the return data below
+        # the servers for the return data below
         if changed:
-            result = axapi_call(module, session_url + '&method=slb.server.search', json.dumps({'name': slb_server}))
-        else:
-            result = slb_server_data
-    elif state == 'absent':
-        if slb_server_exists:
-            result = axapi_call(module, session_url + '&method=slb.server.delete', json.dumps({'name': slb_server}))
-            changed = True
-        else:
+            defined_servers = get_all_servers(module, session)
+        result = dict((server['server_name'],
+                       defined_servers.get(server['server_name'],
+                                           dict(msg="the server was not present")))
+                      for server in servers)
+    else:
+        slb_server_data = axapi_session_call(module, session, 'slb.server.search', json.dumps({'name': slb_server}))
+        slb_server_exists = not axapi_failure(slb_server_data)
+
+        changed, result = manage_server(module, session, state, slb_server,
+                                        slb_server_ip, slb_server_status,
+                                        slb_server_ports,
+                                        slb_server_exists and slb_server_data.get('server', {}) or None)
+
+        if state == 'present':
+            # if we changed things, get the full info regarding
+            # the server for the return data below
+            if changed:
+                result = axapi_session_call(module, session, 'slb.server.search', json.dumps({'name': slb_server}))
+            else:
+                result = slb_server_data
+        elif not changed:
             result = dict(msg="the  server was not present")
 
     # if the config has changed, save the config unless otherwise requested
-    if changed and write_config:
-        write_result = axapi_call(module, session_url + '&method=system.action.write_memory')
-        if axapi_failure(write_result):
-            module.fail_json(msg="failed to save the configuration: %s" % write_result['response']['err']['msg'])
+    saved = axapi_save_config(module, session, changed, write_config,
+                              deferred_write, flush_config)
 
     # log out of the session nicely and exit
-    axapi_call(module, session_url + '&method=session.close')
-    module.exit_json(changed=changed, content=result)
+    axapi_close_session(module, session)
+    module.exit_json(changed=changed or saved, content=result)
 
 # standard ansible module imports
 from ansible.module_utils.basic import *
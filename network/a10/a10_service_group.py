@@ -56,8 +56,9 @@ options:
     choices: []
   service_group:
     description:
-      - slb service-group name
-    required: true
+      - slb service-group name. Required unless the task only flushes the
+        configuration with C(flush_config).
+    required: false
     default: null
     aliases: ['service', 'pool', 'group']
     choices: []
@@ -100,6 +101,46 @@ options:
     required: false
     default: 'yes'
     choices: ['yes', 'no']
+  session_cache:
+    description:
+      - Path of a file on the executing host in which the aXAPI session id is
+        stored. The a10 modules share it, and tasks within C(session_ttl)
+        seconds reuse the session instead of authenticating and closing a new
+        one. A session the device has dropped is replaced transparently.
+        The file is only readable by its owner.
+    required: false
+    default: null
+    aliases: []
+    choices: []
+    version_added: 2.0
+  session_ttl:
+    description:
+      - Number of seconds a cached session id is reused for.
+    required: false
+    default: 600
+    aliases: []
+    choices: []
+    version_added: 2.0
+  deferred_write:
+    description:
+      - Path of a file on the executing host in which devices with unsaved
+        configuration changes are recorded. When set, C(write_config) only
+        marks the device there, and the configuration is written to memory
+        once by a later task with C(flush_config).
+    required: false
+    default: null
+    aliases: []
+    choices: []
+    version_added: 2.0
+  flush_config:
+    description:
+      - If C(yes), write the configuration to memory when the device is marked
+        in C(deferred_write), and clear the mark. The object options may be
+        left out to only flush.
+    required: false
+    default: "no"
+    choices: ["yes", "no"]
+    version_added: 2.0
 
 '''
 
@@ -121,11 +162,184 @@ EXAMPLES = '''
         port: 8080
         status: disabled
 
+# Save the configuration once at the end of the play
+- a10_service_group:
+    host: a10.mydomain.com
+    username: myadmin
+    password: mypassword
+    session_cache: ~/.ansible/a10_sessions.json
+    deferred_write: ~/.ansible/a10_unsaved.json
+    flush_config: yes
+
 '''
 
+import fcntl
+import os
+import tempfile
+import time
+
 VALID_SERVICE_GROUP_FIELDS = ['name', 'protocol', 'lb_method']
 VALID_SERVER_FIELDS = ['server', 'port', 'status']
 
+# aXAPI error code of a session id the device does not know (anymore)
+AXAPI_INVALID_SESSION = 1009
+
+def write_json_file(path, data):
+    # write to a unique temporary file in the same directory first, so
+    # readers never see partial content; mkstemp creates it with mode 0600
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        f = os.fdopen(fd, 'w')
+        try:
+            json.dump(data, f)
+        finally:
+            f.close()
+        os.rename(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+def load_json_file(path):
+    if not os.path.exists(path):
+        return {}
+    try:
+        return json.load(open(path))
+    except ValueError:
+        return {}
+
+def update_json_file(path, update):
+    '''
+    Applies update to the content of the file while holding an exclusive
+    lock, as the forks of a play share the file. The lock is taken on a
+    separate file, since writing replaces the file itself.
+    '''
+    lock_fd = os.open(path + '.lock', os.O_WRONLY | os.O_CREAT, 0600)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        data = load_json_file(path)
+        update(data)
+        write_json_file(path, data)
+    finally:
+        os.close(lock_fd)
+
+def load_session_id(path, host, username, ttl):
+    # returns the cached session id, and whether it is younger than ttl
+    entry = load_json_file(path).get("%s@%s" % (username, host))
+    if not entry:
+        return (None, False)
+    return (entry['id'], time.time() - entry['time'] < ttl)
+
+def save_session_id(path, host, username, session_id):
+    def update(sessions):
+        sessions["%s@%s" % (username, host)] = {'id': session_id,
+                                                'time': time.time()}
+    update_json_file(path, update)
+
+def config_dirty(path, host):
+    # returns when the device was marked dirty, or None
+    return load_json_file(path).get(host)
+
+def set_config_dirty(path, host):
+    def update(hosts):
+        hosts[host] = time.time()
+    update_json_file(path, update)
+
+def clear_config_dirty(path, host, marked):
+    # keep the mark if another task set it again meanwhile
+    def update(hosts):
+        if hosts.get(host) == marked:
+            del hosts[host]
+    update_json_file(path, update)
+
+def axapi_session_invalid(result):
+    return axapi_failure(result) and \
+        result['response'].get('err', {}).get('code') == AXAPI_INVALID_SESSION
+
+def axapi_new_session(module, session):
+    session['url'] = axapi_authenticate(module, session['base_url'],
+                                        session['username'], session['password'])
+    session['cached'] = False
+    if session['cache']:
+        save_session_id(session['cache'], session['host'], session['username'],
+                        session['url'].split('&session_id=')[-1])
+
+def axapi_open_session(module, host, base_url, username, password,
+                       session_cache=None, session_ttl=0):
+    '''
+    Returns a session, reusing the session id cached in session_cache
+    when it is younger than session_ttl seconds.
+    '''
+    session = {'host': host, 'base_url': base_url, 'username': username,
+               'password': password, 'cache': session_cache, 'cached': False}
+    session_id, fresh = (None, False)
+    if session_cache:
+        session_id, fresh = load_session_id(session_cache, host, username,
+                                             session_ttl)
+    if session_id and fresh:
+        session['url'] = '%s&session_id=%s' % (base_url, session_id)
+        session['cached'] = True
+    else:
+        if session_id:
+            # close the expired session rather than leaving it open on the
+            # device until its idle timeout; the result does not matter, it
+            # may already be gone
+            axapi_call(module, '%s&session_id=%s&method=session.close' %
+                       (base_url, session_id))
+        axapi_new_session(module, session)
+    return session
+
+def axapi_session_call(module, session, method, post=None):
+    result = axapi_call(module, '%s&method=%s' % (session['url'], method), post)
+    if session['cached'] and axapi_session_invalid(result):
+        # the device dropped the cached session, e.g. after its idle timeout
+        axapi_new_session(module, session)
+        result = axapi_call(module, '%s&method=%s' % (session['url'], method), post)
+    return result
+
+def axapi_close_session(module, session):
+    # a cached session is left open for the following tasks
+    if not session['cache']:
+        axapi_session_call(module, session, 'session.close')
+
+def axapi_save_config(module, session, changed, write_config, deferred_write,
+                      flush_config):
+    '''
+    Writes the configuration to memory when it changed and write_config is
+    set. With deferred_write the device is only marked dirty, and a later
+    task with flush_config writes it once. Returns whether it was written.
+    '''
+    host = session['host']
+    save = changed and write_config
+    if save and deferred_write:
+        set_config_dirty(deferred_write, host)
+        save = False
+    marked = None
+    if flush_config:
+        marked = config_dirty(deferred_write, host)
+        if marked is not None:
+            save = True
+    if not save:
+        return False
+    write_result = axapi_session_call(module, session, 'system.action.write_memory')
+    if axapi_failure(write_result):
+        module.fail_json(msg="failed to save the configuration: %s" % write_result['response']['err']['msg'])
+    if marked is not None:
+        clear_config_dirty(deferred_write, host, marked)
+    return True
+
+def axapi_flush_only(module, host, base_url, username, password, session_cache,
+                     session_ttl, deferred_write):
+    # a task without an object only writes the changes recorded earlier
+    session = axapi_open_session(module, host, base_url, username, password,
+                                 session_cache, session_ttl)
+    saved = axapi_save_config(module, session, False, False, deferred_write, True)
+    axapi_close_session(module, session)
+    if saved:
+        result = dict(msg="the configuration was written to memory")
+    else:
+        result = dict(msg="there were no unsaved changes")
+    module.exit_json(changed=saved, content=result)
+
 def validate_servers(module, servers):
     for item in servers:
         for key in item:
@@ -158,7 +372,7 @@ def main():
     argument_spec.update(
         dict(
             state=dict(type='str', default='present', choices=['present', 'absent']),
-            service_group=dict(type='str', aliases=['service', 'pool', 'group'], required=True),
+            service_group=dict(type='str', aliases=['service', 'pool', 'group']),
             service_group_protocol=dict(type='str', default='tcp', aliases=['proto', 'protocol'], choices=['tcp', 'udp']),
             service_group_method=dict(type='str', default='round-robin',
                                       aliases=['method'],
@@ -174,6 +388,10 @@ def main():
                                                'src-ip-only-hash',
                                                'src-ip-hash']),
             servers=dict(type='list', aliases=['server', 'member'], default=[]),
+            session_cache=dict(type='str'),
+            session_ttl=dict(type='int', default=600),
+            deferred_write=dict(type='str'),
+            flush_config=dict(type='bool', default=False),
         )
     )
 
@@ -187,15 +405,31 @@ def main():
     password = module.params['password']
     state = module.params['state']
     write_config = module.params['write_config']
+    session_cache = module.params['session_cache']
+    session_ttl = module.params['session_ttl']
+    deferred_write = module.params['deferred_write']
+    flush_config = module.params['flush_config']
     slb_service_group = module.params['service_group']
     slb_service_group_proto = module.params['service_group_protocol']
     slb_service_group_method = module.params['service_group_method']
     slb_servers = module.params['servers']
 
+    if session_cache:
+        session_cache = os.path.expanduser(session_cache)
+    if deferred_write:
+        deferred_write = os.path.expanduser(deferred_write)
+    if flush_config and not deferred_write:
+        module.fail_json(msg='flush_config requires deferred_write')
+
+    axapi_base_url = 'https://' + host + '/services/rest/V2.1/?format=json'
+
+    if flush_config and slb_service_group is None:
+        axapi_flush_only(module, host, axapi_base_url, username, password,
+                         session_cache, session_ttl, deferred_write)
+
     if slb_service_group is None:
         module.fail_json(msg='service_group is required')
 
-    axapi_base_url = 'https://' + host + '/services/rest/V2.1/?format=json'
     load_balancing_methods = {'round-robin': 0,
                               'weighted-rr': 1,
                               'least-connection': 2,
@@ -225,10 +459,11 @@ def main():
     }
 
     # first we authenticate to get a session id
-    session_url = axapi_authenticate(module, axapi_base_url, username, password)
+    session = axapi_open_session(module, host, axapi_base_url, username, password,
+                                 session_cache, session_ttl)
 
     # then we check to see if the specified group exists
-    slb_result = axapi_call(module, session_url + '&method=slb.service_group.search', json.dumps({'name': slb_service_group}))
+    slb_result = axapi_session_call(module, session, 'slb.service_group.search', json.dumps({'name': slb_service_group}))
     slb_service_group_exist = not axapi_failure(slb_result)
 
     changed = False
@@ -237,13 +472,13 @@ def main():
         # defined in the servers list exist to prevent errors
         checked_servers = []
         for server in slb_servers:
-            result = axapi_call(module, session_url + '&method=slb.server.search', json.dumps({'name': server['server']}))
+            result = axapi_session_call(module, session, 'slb.server.search', json.dumps({'name': server['server']}))
             if axapi_failure(result):
                 module.fail_json(msg="the server %s specified in the servers list does not exist" % server['server'])
             checked_servers.append(server['server'])
 
         if not slb_service_group_exist:
-            result = axapi_call(module, session_url + '&method=slb.service_group.create', json.dumps(json_post))
+            result = axapi_session_call(module, session, 'slb.service_group.create', json.dumps(json_post))
             if axapi_failure(result):
                 module.fail_json(msg=result['response']['err']['msg'])
             changed = True
@@ -258,7 +493,7 @@ def main():
                     break
 
             if do_update:
-                result = axapi_call(module, session_url + '&method=slb.service_group.update', json.dumps(json_post))
+                result = axapi_session_call(module, session, 'slb.service_group.update', json.dumps(json_post))
                 if axapi_failure(result):
                     module.fail_json(msg=result['response']['err']['msg'])
                 changed = True
@@ -287,10 +522,10 @@ def main():
                 "member": server,
             }
             if not found:
-                result = axapi_call(module, session_url + '&method=slb.service_group.member.create', json.dumps(server_data))
+                result = axapi_session_call(module, session, 'slb.service_group.member.create', json.dumps(server_data))
                 changed = True
             elif different:
-                result = axapi_call(module, session_url + '&method=slb.service_group.member.update', json.dumps(server_data))
+                result = axapi_session_call(module, session, 'slb.service_group.member.update', json.dumps(server_data))
                 changed = True
 
         # finally, remove any servers that are on the target
@@ -307,31 +542,29 @@ def main():
                 "member": server,
             }
             if not found:
-                result = axapi_call(module, session_url + '&method=slb.service_group.member.delete', json.dumps(server_data))
+                result = axapi_session_call(module, session, 'slb.service_group.member.delete', json.dumps(server_data))
                 changed = True
 
         # if we changed things, get the full info regarding
         # the service group for the return data below
         if changed:
-            result = axapi_call(module, session_url + '&method=slb.service_group.search', json.dumps({'name': slb_service_group}))
+            result = axapi_session_call(module, session, 'slb.service_group.search', json.dumps({'name': slb_service_group}))
         else:
             result = slb_result
     elif state == 'absent':
         if slb_service_group_exist:
-            result = axapi_call(module, session_url + '&method=slb.service_group.delete', json.dumps({'name': slb_service_group}))
+            result = axapi_session_call(module, session, 'slb.service_group.delete', json.dumps({'name': slb_service_group}))
             changed = True
         else:
             result = dict(msg="the service group was not present")
 
     # if the config has changed, save the config unless otherwise requested
-    if changed and write_config:
-        write_result = axapi_call(module, session_url + '&method=system.action.write_memory')
-        if axapi_failure(write_result):
-            module.fail_json(msg="failed to save the configuration: %s" % write_result['response']['err']['msg'])
+    saved = axapi_save_config(module, session, changed, write_config,
+                              deferred_write, flush_config)
 
     # log out of the session nicely and exit
-    axapi_call(module, session_url + '&method=session.close')
-    module.exit_json(changed=changed, content=result)
+    axapi_close_session(module, session)
+    module.exit_json(changed=changed or saved, content=result)
 
 # standard ansible module imports
 from ansible.module_utils.basic import *
@@ -62,7 +62,9 @@ options:
     aliases: []
   name:
     description:
-      - name of the entity
+      - name of the entity, or a list of names. All entities are enabled or
+        disabled with one bulk request, and the entities which failed are
+        reported with their error.
     required: true
     default: hostname
     aliases: []
@@ -80,6 +82,11 @@ options:
     required: false
     default: 'yes'
     choices: ['yes', 'no']
+notes:
+  - The module logs in once through the Nitro login resource and sends all
+    requests with the returned session token, over a single keep-alive
+    connection when the ssl module of the python interpreter can honour
+    C(validate_certs) (python >= 2.7.9).
 
 requirements: [ "urllib", "urllib2" ]
 author: Nandor Sivok
@@ -94,11 +101,15 @@ ansible host -m netscaler -a "nsc_host=nsc.example.com user=apiuser password=api
 
 # Disable the service local:8080
 ansible host -m netscaler -a "nsc_host=nsc.example.com user=apiuser password=apipass name=local:8080 type=service action=disable"
+
+# Disable several servers with one request
+ansible host -m netscaler -a "nsc_host=nsc.example.com user=apiuser password=apipass name=web1,web2,web3 action=disable"
 '''
 
 
-import base64
+import httplib
 import socket
+import ssl
 
 
 class netscaler(object):
@@ -107,50 +118,141 @@ class netscaler(object):
 
     def __init__(self, module):
         self.module = module
+        self._conn = None
+        self._token = None
+
+    def connect(self):
+        # keep one connection open for all requests; without SSLContext
+        # support validate_certs is only honoured by fetch_url, so fall
+        # back to one fetch_url request each
+        if self._nsc_protocol == 'http':
+            self._conn = httplib.HTTPConnection(self._nsc_host)
+        elif hasattr(ssl, 'create_default_context'):
+            if self.module.params['validate_certs']:
+                context = ssl.create_default_context()
+            else:
+                context = ssl._create_unverified_context()
+            self._conn = httplib.HTTPSConnection(self._nsc_host, context=context)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def http_request(self, api_endpoint, data_json=None, headers={}):
+        request_url = self._nitro_base_url + api_endpoint
+
+        data = None
+        if data_json is not None:
+            data = json.dumps(data_json)
+
+        headers = dict(headers)
+        headers['Content-Type'] = 'application/json'
+        if self._token:
+            headers['Cookie'] = 'NITRO_AUTH_TOKEN=%s' % self._token
+
+        if self._conn is None:
+            request_url = self._nsc_protocol + '://' + self._nsc_host + request_url
+            response, info = fetch_url(self.module, request_url, data=data, headers=headers)
+            status, reason = info['status'], info['msg']
+            if response is not None:
+                body = response.read()
+            else:
+                # HTTP errors keep their body, which holds the Nitro error
+                # and, for bulk requests, the result of every object
+                body = info.get('body')
+                if not body:
+                    raise Exception("request to %s failed: %s" % (request_url, info['msg']))
+        else:
+            if data is None:
+                self._conn.request('GET', request_url, headers=headers)
+            else:
+                self._conn.request('POST', request_url, data, headers)
+            # read the whole body, the connection is only reusable afterwards
+            response = self._conn.getresponse()
+            status, reason = response.status, response.reason
+            body = response.read()
+        if not body and status < 400:
+            return {'errorcode': 0}
+        # error pages of the appliance or of a proxy are not Nitro replies
+        try:
+            resp = json.loads(body)
+        except ValueError:
+            resp = None
+        if not isinstance(resp, dict) or 'errorcode' not in resp:
+            raise Exception("request to %s failed (status %s): %s" % (request_url, status, reason))
+        return resp
 
-    def http_request(self, api_endpoint, data_json={}):
-        request_url = self._nsc_protocol + '://' + self._nsc_host + self._nitro_base_url + api_endpoint
-
-        data_json = urllib.urlencode(data_json)
-        if not len(data_json):
-            data_json = None
-
-        auth = base64.encodestring('%s:%s' % (self._nsc_user, self._nsc_pass)).replace('\n', '').strip()
-        headers = {
-            'Authorization': 'Basic %s' % auth,
-            'Content-Type' : 'application/x-www-form-urlencoded',
-        }
+    def login(self):
+        resp = self.http_request(
+            'config/login',
+            {
+                "login":
+                {
+                    "username": self._nsc_user,
+                    "password": self._nsc_pass
+                }
+            }
+        )
+        if resp.get('errorcode') == 0:
+            self._token = resp.get('sessionid')
 
-        response, info = fetch_url(self.module, request_url, data=data_json, headers=headers)
+        return resp
 
-        return json.load(response)
+    def logout(self):
+        if self._token:
+            self.http_request('config/logout', {"logout": {}})
+            self._token = None
 
     def prepare_request(self, action):
+        # one bulk request for all names; with X-NITRO-ONERROR the other
+        # objects are still processed when one of them fails
         resp = self.http_request(
-            'config',
+            'config/%s?action=%s' % (self._type, action),
             {
-                "object":
-                {
-                    "params": {"action": action},
-                    self._type: {"name": self._name}
-                }
-            }
+                self._type: [{"name": name} for name in self._names]
+            },
+            {'X-NITRO-ONERROR': 'continue'}
         )
 
         return resp
 
 
+def get_failed_names(names, resp):
+    # a failed bulk request lists the result of every object in order
+    failed = {}
+    for name, item in zip(names, resp.get('response', [])):
+        if item.get('errorcode', 0) != 0:
+            failed[name] = item.get('message')
+    return failed
+
+
 def core(module):
     n = netscaler(module)
     n._nsc_host = module.params.get('nsc_host')
     n._nsc_user = module.params.get('user')
     n._nsc_pass = module.params.get('password')
     n._nsc_protocol = module.params.get('nsc_protocol')
-    n._name = module.params.get('name')
+    n._names = module.params.get('name')
     n._type = module.params.get('type')
     action = module.params.get('action')
 
-    r = n.prepare_request(action)
+    n.connect()
+    try:
+        r = n.login()
+        if r['errorcode'] != 0:
+            return r['errorcode'], r
+
+        try:
+            r = n.prepare_request(action)
+        finally:
+            n.logout()
+    finally:
+        n.close()
+
+    r['names'] = n._names
+    if r['errorcode'] != 0:
+        r['failed_names'] = get_failed_names(n._names, r)
 
     return r['errorcode'], r
 
@@ -164,7 +266,7 @@ def main():
             user = dict(required=True),
             password = dict(required=True),
             action = dict(default='enable', choices=['enable','disable']),
-            name = dict(default=socket.gethostname()),
+            name = dict(default=socket.gethostname(), type='list'),
             type = dict(default='server', choices=['service', 'server']),
             validate_certs=dict(default='yes', type='bool'),
         )
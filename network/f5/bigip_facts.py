@@ -37,7 +37,10 @@ requirements:
 options:
     server:
         description:
-            - BIG-IP host
+            - BIG-IP host, or list of hosts. When several hosts are given,
+              facts are collected from them in parallel and returned as the
+              C(bigip_devices) fact, keyed by host. Hosts that fail are
+              reported in C(failed_devices) without aborting the others.
         required: true
         default: null
         choices: []
@@ -70,9 +73,11 @@ options:
         required: true
         default: null
         choices: ['address_class', 'certificate', 'client_ssl_profile',
-                  'device_group', 'interface', 'key', 'node', 'pool', 'rule',
-                  'self_ip', 'software', 'system_info', 'traffic_group',
-                  'trunk', 'virtual_address', 'virtual_server', 'vlan']
+                  'device_group', 'interface', 'key', 'node', 'pool',
+                  'pool_member_stats', 'pool_stats', 'rule', 'self_ip',
+                  'software', 'system_info', 'traffic_group', 'trunk',
+                  'virtual_address', 'virtual_server', 'virtual_server_stats',
+                  'vlan']
         aliases: []
     filter:
         description:
@@ -82,6 +87,197 @@ options:
         default: null
         choices: []
         aliases: []
+    workers:
+        description:
+            - Number of fact categories to collect concurrently. Each worker
+              opens its own iControl session. The default of 1 collects the
+              categories one after another over a single connection.
+        required: false
+        default: 1
+        choices: []
+        aliases: []
+        version_added: "2.0"
+    fields:
+        description:
+            - Dictionary mapping fact categories to the list of fields to
+              collect for them. Only the getters for the requested fields are
+              called. Categories that are not listed return all fields. The
+              fields are the names returned for the category, and unknown
+              names are rejected. For statistics categories the fields are
+              statistic types, such as
+              C(STATISTIC_SERVER_SIDE_CURRENT_CONNECTIONS), and are not
+              checked. Not applicable for certificate, key and software fact
+              categories.
+        required: false
+        default: null
+        choices: []
+        aliases: []
+        version_added: "2.0"
+    method_cache:
+        description:
+            - Path of a file in which getters that the device does not support
+              are recorded, keyed by BIG-IP product version. Recorded getters
+              are not called again against devices running the same version.
+        required: false
+        default: null
+        choices: []
+        aliases: []
+        version_added: "2.0"
+    chunk_size:
+        description:
+            - Maximum number of objects queried by a single iControl call.
+              Large object lists are split into chunks of this size, which
+              bounds the size of each SOAP response held in memory. By default
+              all objects of a category are queried at once.
+        required: false
+        default: null
+        choices: []
+        aliases: []
+        version_added: "2.0"
+    partitions:
+        description:
+            - List of partitions to collect facts from. Each partition is set
+              as the active folder and queried non-recursively, so only its
+              objects are returned by the device. Applies to the
+              address_class, client_ssl_profile, node, pool, rule, self_ip,
+              virtual_address, virtual_server and vlan fact categories. When
+              omitted, the folder given by the literal prefix of C(filter)
+              is queried recursively, or the whole device if there is none.
+        required: false
+        default: null
+        choices: []
+        aliases: []
+        version_added: "2.0"
+    cache_dir:
+        description:
+            - Directory in which collected facts are cached. A cached snapshot
+              is returned instead of querying the device while it is younger
+              than C(cache_ttl) and, if C(cache_device_group) is set, the sync
+              status of that device group has not changed. Snapshots are keyed
+              by server, user, include, filter, fields and partitions. The
+              statistics categories are never cached and always read live.
+        required: false
+        default: null
+        choices: []
+        aliases: []
+        version_added: "2.0"
+    cache_ttl:
+        description:
+            - Maximum age in seconds of a cached snapshot. This is the only
+              bound on how stale cached facts can be, as configuration changes
+              are not reliably detected; keep it short when the facts drive
+              changes.
+        required: false
+        default: 300
+        choices: []
+        aliases: []
+        version_added: "2.0"
+    cache_device_group:
+        description:
+            - Device group whose sync status is compared with the one recorded
+              in the cached snapshot. A changed status discards the snapshot
+              early, for instance when changes are pending or a sync failed,
+              but the status does not change on every commit (changes on a
+              standalone device or already synced changes keep it as is), so
+              this does not replace C(cache_ttl).
+        required: false
+        default: null
+        choices: []
+        aliases: []
+        version_added: "2.0"
+    diff_snapshot:
+        description:
+            - Path of a snapshot file on the executing host. When set, only the
+              changes since the facts stored in this file are returned, as the
+              C(bigip_diff) fact. For each category it lists the added objects,
+              the removed object names and the field level changes of modified
+              objects. The file is then replaced with the collected facts.
+        required: false
+        default: null
+        choices: []
+        aliases: []
+        version_added: "2.0"
+    output_format:
+        description:
+            - Shape of the collected facts. C(dict) returns a dictionary of
+              fields for every object. C(columnar) returns, for each category,
+              a C(names) list of objects and a C(fields) dictionary holding
+              one array per field, parallel to C(names). This avoids repeating
+              every field name for every object. The certificate, key,
+              software and system_info categories are returned unchanged.
+        required: false
+        default: dict
+        choices: ['dict', 'columnar']
+        aliases: []
+        version_added: "2.0"
+    dest:
+        description:
+            - Path of a file on the executing host to which the facts are
+              written instead of being returned. Each category is written as
+              one JSON Lines record as soon as it has been collected, gzip
+              compressed if the path ends with C(.gz). Only the object count
+              and collection time of each category are returned.
+        required: false
+        default: null
+        choices: []
+        aliases: []
+        version_added: "2.0"
+    max_concurrency:
+        description:
+            - Maximum number of hosts collected from at the same time when
+              C(server) is a list.
+        required: false
+        default: 10
+        choices: []
+        aliases: []
+        version_added: "2.0"
+    stats_sample_file:
+        description:
+            - Path of a file on the executing host in which the counters of the
+              pool_stats, pool_member_stats and virtual_server_stats categories
+              are stored. When the file holds a previous sample, the per-second
+              change of every counter is returned in an additional
+              C(<category>_rate) fact. The file is then replaced with the new
+              sample.
+        required: false
+        default: null
+        choices: []
+        aliases: []
+        version_added: "2.0"
+    wsdl_cache_dir:
+        description:
+            - Directory in which the parsed iControl WSDLs are cached, in one
+              subdirectory per host and software version. Later runs against the
+              same host and version load them from disk instead of downloading
+              and parsing them again. Finding the software version costs one
+              extra get_version call, through a second client, on each run.
+        required: false
+        default: null
+        choices: []
+        aliases: []
+        version_added: "2.0"
+    session_cache:
+        description:
+            - Path of a file on the executing host in which the iControl
+              session identifier is stored when C(session) is enabled. Runs
+              within C(session_ttl) seconds reuse it instead of requesting a
+              new one. The reused session is checked by the first call the run
+              makes anyway, and a session the device has dropped is replaced
+              and the new identifier is stored. The file is only readable by
+              its owner.
+        required: false
+        default: null
+        choices: []
+        aliases: []
+        version_added: "2.0"
+    session_ttl:
+        description:
+            - Number of seconds a cached session identifier is reused for.
+        required: false
+        default: 600
+        choices: []
+        aliases: []
+        version_added: "2.0"
 '''
 
 EXAMPLES = '''
@@ -101,6 +297,85 @@ EXAMPLES = '''
       password=mysecret
       include=interface,vlan
 
+  - name: Collect large fact categories in parallel
+    local_action: >
+      bigip_facts
+      server=lb.mydomain.com
+      user=admin
+      password=mysecret
+      include=virtual_server,pool,node,rule,client_ssl_profile
+      workers=5
+
+  - name: Collect only the virtual server fields we need
+    local_action:
+      module: bigip_facts
+      server: lb.mydomain.com
+      user: admin
+      password: mysecret
+      include: virtual_server
+      fields:
+        virtual_server: [destination, default_pool_name, enabled_state]
+      method_cache: ~/.ansible/bigip_methods.json
+
+  - name: Collect pools of a single tenant partition
+    local_action: >
+      bigip_facts
+      server=lb.mydomain.com
+      user=admin
+      password=mysecret
+      include=pool
+      partitions=Tenant1
+
+  - name: Reuse facts while the configuration is unchanged
+    local_action: >
+      bigip_facts
+      server=lb.mydomain.com
+      user=admin
+      password=mysecret
+      include=virtual_server,pool
+      cache_dir=/var/cache/bigip_facts
+      cache_ttl=3600
+      cache_device_group=/Common/device-group-sync
+
+  - name: Report virtual server changes since the previous run
+    local_action: >
+      bigip_facts
+      server=lb.mydomain.com
+      user=admin
+      password=mysecret
+      include=virtual_server
+      diff_snapshot=/var/lib/bigip/lb.mydomain.com-vs.json
+
+  - name: Write a full inventory to a compressed file
+    local_action: >
+      bigip_facts
+      server=lb.mydomain.com
+      user=admin
+      password=mysecret
+      include=virtual_server,pool,node
+      dest=/var/lib/bigip/lb.mydomain.com.jsonl.gz
+
+  - name: Collect facts from many devices in one task
+    local_action: >
+      bigip_facts
+      server=lb1.mydomain.com,lb2.mydomain.com,lb3.mydomain.com
+      user=admin
+      password=mysecret
+      include=pool
+      max_concurrency=20
+
+  - name: Collect pool member connection counters and their rates
+    local_action:
+      module: bigip_facts
+      server: lb.mydomain.com
+      user: admin
+      password: mysecret
+      include: pool_member_stats
+      fields:
+        pool_member_stats: [STATISTIC_SERVER_SIDE_CURRENT_CONNECTIONS,
+                            STATISTIC_SERVER_SIDE_TOTAL_CONNECTIONS]
+      stats_sample_file: /var/lib/bigip/lb.mydomain.com-stats.json
+
 '''
 
 try:
@@ -112,13 +387,33 @@ else:
     bigsuds_found = True
 
 import fnmatch
+import gzip
+import hashlib
+import json
+import os
 import traceback
 import re
+import sys
+import tempfile
+import threading
+import time
+import Queue
 
 # ===========================================
 # bigip_facts module specific support methods.
 #
 
+def wsdl_cache_path(host, user, password, wsdl_cache_dir):
+    hostdir = os.path.join(wsdl_cache_dir, host)
+    # the lookup only relies on SystemInfo.get_version existing on every
+    # release; its WSDL stays in the host directory, which suds expires after
+    # a day like the rest of its cache
+    api = bigsuds.BIGIP(hostname=host, username=user, password=password,
+                        cachedir=hostdir)
+    version = api.System.SystemInfo.get_version()
+    return os.path.join(hostdir, version.replace(os.sep, '_'))
+
+
 class F5(object):
     """F5 iControl class.
 
@@ -126,24 +421,59 @@ class F5(object):
 
     Attributes:
         api: iControl API instance.
+        session_id: iControl session identifier, if a session is used.
+        active_folder: Last known active folder of the session.
+        recursive_query_state: Last known recursive query state of the session.
     """
 
-    def __init__(self, host, user, password, session=False):
-        self.api = bigsuds.BIGIP(hostname=host, username=user, password=password)
+    def __init__(self, host, user, password, session=False,
+                 wsdl_cache_dir=None, session_id=None):
+        cachedir = None
+        if wsdl_cache_dir:
+            cachedir = wsdl_cache_path(host, user, password, wsdl_cache_dir)
+        self.base_api = bigsuds.BIGIP(hostname=host, username=user,
+                                      password=password, cachedir=cachedir)
+        self.api = self.base_api
+        self.session_id = None
+        self.active_folder = None
+        self.recursive_query_state = None
+        self.session_reused = False
         if session:
-            self.start_session()
+            self.start_session(session_id)
+
+    def start_session(self, session_id=None):
+        if session_id is None:
+            session_id = self.base_api.System.Session.get_session_identifier()
+        else:
+            # checked by the first check_session call instead of up front
+            self.session_reused = True
+        self.api = self.base_api.with_session_id(session_id)
+        self.session_id = session_id
 
-    def start_session(self):
-        self.api = self.api.with_session_id()
+    def check_session(self):
+        """Reads the active folder, which also checks a reused session.
+
+        A reused session that the device has dropped is replaced by a new one.
+        """
+        try:
+            return self.get_active_folder()
+        except WebFault:
+            if not self.session_reused:
+                raise
+            self.session_reused = False
+            self.start_session()
+            return self.get_active_folder()
 
     def get_api(self):
         return self.api
 
     def set_recursive_query_state(self, state):
         self.api.System.Session.set_recursive_query_state(state)
+        self.recursive_query_state = state
 
     def get_recursive_query_state(self):
-        return self.api.System.Session.get_recursive_query_state()
+        self.recursive_query_state = self.api.System.Session.get_recursive_query_state()
+        return self.recursive_query_state
 
     def enable_recursive_query_state(self):
         self.set_recursive_query_state('STATE_ENABLED')
@@ -153,9 +483,19 @@ class F5(object):
 
     def set_active_folder(self, folder):
         self.api.System.Session.set_active_folder(folder=folder)
+        self.active_folder = folder
 
     def get_active_folder(self):
-        return self.api.System.Session.get_active_folder()
+        self.active_folder = self.api.System.Session.get_active_folder()
+        return self.active_folder
+
+    def set_query_scope(self, folder, recursive=True):
+        if folder != self.active_folder:
+            self.set_active_folder(folder)
+        if recursive and self.recursive_query_state != 'STATE_ENABLED':
+            self.enable_recursive_query_state()
+        elif not recursive and self.recursive_query_state != 'STATE_DISABLED':
+            self.disable_recursive_query_state()
 
 
 class Interfaces(object):
@@ -178,6 +518,9 @@ class Interfaces(object):
     def get_list(self):
         return self.interfaces
 
+    def set_list(self, interfaces):
+        self.interfaces = interfaces
+
     def get_active_media(self):
         return self.api.Networking.Interfaces.get_active_media(self.interfaces)
 
@@ -283,6 +626,9 @@ class SelfIPs(object):
     def get_list(self):
         return self.self_ips
 
+    def set_list(self, self_ips):
+        self.self_ips = self_ips
+
     def get_address(self):
         return self.api.Networking.SelfIPV2.get_address(self.self_ips)
 
@@ -337,6 +683,9 @@ class Trunks(object):
     def get_list(self):
         return self.trunks
 
+    def set_list(self, trunks):
+        self.trunks = trunks
+
     def get_active_lacp_state(self):
         return self.api.Networking.Trunk.get_active_lacp_state(self.trunks)
 
@@ -397,6 +746,9 @@ class Vlans(object):
     def get_list(self):
         return self.vlans
 
+    def set_list(self, vlans):
+        self.vlans = vlans
+
     def get_auto_lasthop(self):
         return self.api.Networking.VLAN.get_auto_lasthop(self.vlans)
 
@@ -491,6 +843,9 @@ class VirtualServers(object):
     def get_list(self):
         return self.virtual_servers
 
+    def set_list(self, virtual_servers):
+        self.virtual_servers = virtual_servers
+
     def get_actual_hardware_acceleration(self):
         return self.api.LocalLB.VirtualServer.get_actual_hardware_acceleration(self.virtual_servers)
 
@@ -620,6 +975,9 @@ class VirtualServers(object):
     def get_wildmask(self):
         return self.api.LocalLB.VirtualServer.get_wildmask(self.virtual_servers)
 
+    def get_statistics(self):
+        return self.api.LocalLB.VirtualServer.get_statistics(self.virtual_servers)
+
 
 class Pools(object):
     """Pools class.
@@ -641,6 +999,9 @@ class Pools(object):
     def get_list(self):
         return self.pool_names
 
+    def set_list(self, pool_names):
+        self.pool_names = pool_names
+
     def get_action_on_service_down(self):
         return self.api.LocalLB.Pool.get_action_on_service_down(self.pool_names)
 
@@ -725,6 +1086,12 @@ class Pools(object):
     def get_slow_ramp_time(self):
         return self.api.LocalLB.Pool.get_slow_ramp_time(self.pool_names)
 
+    def get_statistics(self):
+        return self.api.LocalLB.Pool.get_statistics(self.pool_names)
+
+    def get_all_member_statistics(self):
+        return self.api.LocalLB.Pool.get_all_member_statistics(self.pool_names)
+
 
 class Devices(object):
     """Devices class.
@@ -746,6 +1113,9 @@ class Devices(object):
     def get_list(self):
         return self.devices
 
+    def set_list(self, devices):
+        self.devices = devices
+
     def get_active_modules(self):
         return self.api.Management.Device.get_active_modules(self.devices)
 
@@ -851,6 +1221,9 @@ class DeviceGroups(object):
     def get_list(self):
         return self.device_groups
 
+    def set_list(self, device_groups):
+        self.device_groups = device_groups
+
     def get_all_preferred_active(self):
         return self.api.Management.DeviceGroup.get_all_preferred_active(self.device_groups)
 
@@ -899,6 +1272,9 @@ class TrafficGroups(object):
     def get_list(self):
         return self.traffic_groups
 
+    def set_list(self, traffic_groups):
+        self.traffic_groups = traffic_groups
+
     def get_auto_failback_enabled_state(self):
         return self.api.Management.TrafficGroup.get_auto_failback_enabled_state(self.traffic_groups)
 
@@ -947,6 +1323,9 @@ class Rules(object):
     def get_list(self):
         return self.rules
 
+    def set_list(self, rules):
+        self.rules = rules
+
     def get_description(self):
         return self.api.LocalLB.Rule.get_description(rule_names=self.rules)
 
@@ -979,6 +1358,9 @@ class Nodes(object):
     def get_list(self):
         return self.nodes
 
+    def set_list(self, nodes):
+        self.nodes = nodes
+
     def get_address(self):
         return self.api.LocalLB.NodeAddressV2.get_address(nodes=self.nodes)
 
@@ -1033,6 +1415,9 @@ class VirtualAddresses(object):
     def get_list(self):
         return self.virtual_addresses
 
+    def set_list(self, virtual_addresses):
+        self.virtual_addresses = virtual_addresses
+
     def get_address(self):
         return self.api.LocalLB.VirtualAddressV2.get_address(self.virtual_addresses)
 
@@ -1090,6 +1475,9 @@ class AddressClasses(object):
     def get_list(self):
         return self.address_classes
 
+    def set_list(self, address_classes):
+        self.address_classes = address_classes
+
     def get_address_class(self):
         key = self.api.LocalLB.Class.get_address_class(self.address_classes)
         value = self.api.LocalLB.Class.get_address_class_member_data_value(key)
@@ -1174,6 +1562,9 @@ class ProfileClientSSL(object):
     def get_list(self):
         return self.profiles
 
+    def set_list(self, profiles):
+        self.profiles = profiles
+
     def get_alert_timeout(self):
         return self.api.LocalLB.ProfileClientSSL.get_alert_timeout(self.profiles)
 
@@ -1356,210 +1747,517 @@ class SystemInfo(object):
         return self.api.System.SystemInfo.get_uptime()
 
 
-def generate_dict(api_obj, fields):
+class FactQuery(object):
+    """Fact query class.
+
+    Tracks which getters should be called for each fact category.
+
+    Attributes:
+        fields: Dict mapping fact categories to the fields to collect.
+        unsupported: Dict mapping fact categories to fields whose getters
+                     are not supported by the device.
+        chunk_size: Maximum number of objects passed to a single getter
+                    call, or None to pass all objects at once.
+        scopes: List of (folder, recursive) tuples that partitioned fact
+                categories are queried from.
+        columnar: True to return per-field arrays instead of per-object
+                  dicts.
+        changed: True if new unsupported getters have been recorded.
+    """
+
+    def __init__(self, fields=None, unsupported=None, chunk_size=None,
+                 scopes=None, columnar=False):
+        self.fields = fields or {}
+        self.unsupported = unsupported or {}
+        self.chunk_size = chunk_size
+        self.scopes = scopes or [("/", True)]
+        self.columnar = columnar
+        self.changed = False
+
+    def select_fields(self, category, fields):
+        requested = self.fields.get(category)
+        skipped = self.unsupported.get(category, [])
+        return [x for x in fields
+                if (not requested or x in requested) and x not in skipped]
+
+    def mark_unsupported(self, category, field):
+        skipped = self.unsupported.setdefault(category, [])
+        if field not in skipped:
+            skipped.append(field)
+            self.changed = True
+
+
+class FactWriter(object):
+    """Fact writer class.
+
+    Streams fact categories to a JSON Lines file as they are collected. The
+    file is gzip compressed when its name ends with .gz.
+
+    Attributes:
+        path: Path of the destination file.
+        summary: Dict mapping written fact categories to their object count
+                 and collection time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if path.endswith('.gz'):
+            self.file = gzip.open(path, 'wb')
+        else:
+            self.file = open(path, 'w')
+        self.lock = threading.Lock()
+        self.summary = {}
+
+    def write(self, category, facts, count, elapsed):
+        line = json.dumps({'category': category, 'facts': facts})
+        self.lock.acquire()
+        try:
+            self.file.write(line + '\n')
+            self.summary[category] = {'count': count,
+                                      'elapsed': round(elapsed, 3)}
+        finally:
+            self.lock.release()
+
+    def close(self):
+        self.file.close()
+
+
+def get_version_key(f5):
+    info = SystemInfo(f5.get_api()).get_product_information()
+    return "%s %s %s" % (info['product_code'], info['product_version'],
+                         info['package_version'])
+
+def load_method_cache(path, version):
+    if not os.path.exists(path):
+        return {}
+    try:
+        cache = json.load(open(path))
+    except ValueError:
+        return {}
+    return cache.get(version, {})
+
+method_cache_lock = threading.Lock()
+
+def save_method_cache(path, version, unsupported):
+    method_cache_lock.acquire()
+    try:
+        cache = {}
+        if os.path.exists(path):
+            try:
+                cache = json.load(open(path))
+            except ValueError:
+                pass
+        cache[version] = unsupported
+        write_json_file(path, cache)
+    finally:
+        method_cache_lock.release()
+
+session_cache_lock = threading.Lock()
+
+def load_session_id(path, server, user, ttl):
+    if not os.path.exists(path):
+        return None
+    try:
+        sessions = json.load(open(path))
+    except ValueError:
+        return None
+    entry = sessions.get("%s@%s" % (user, server))
+    if entry and time.time() - entry['time'] < ttl:
+        return entry['id']
+    return None
+
+def save_session_id(path, server, user, session_id):
+    session_cache_lock.acquire()
+    try:
+        sessions = {}
+        if os.path.exists(path):
+            try:
+                sessions = json.load(open(path))
+            except ValueError:
+                pass
+        sessions["%s@%s" % (user, server)] = {'id': session_id,
+                                              'time': time.time()}
+        write_json_file(path, sessions)
+    finally:
+        session_cache_lock.release()
+
+def write_json_file(path, data):
+    # write to a unique temporary file in the same directory first, so
+    # readers never see partial content; mkstemp creates it with mode 0600
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        f = os.fdopen(fd, 'w')
+        try:
+            json.dump(data, f)
+        finally:
+            f.close()
+        os.rename(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+def get_snapshot_path(cache_dir, key):
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True)).hexdigest()
+    return os.path.join(cache_dir, "bigip_facts-%s.json" % digest)
+
+def get_config_marker(f5, device_group):
+    # only an early invalidation hint: the sync status stays the same across
+    # most commits, so cache_ttl is what actually bounds staleness
+    status = f5.get_api().Management.DeviceGroup.get_sync_status([device_group])
+    return json.dumps(status, sort_keys=True)
+
+def load_snapshot(path, ttl):
+    if not os.path.exists(path):
+        return None
+    if time.time() - os.path.getmtime(path) > ttl:
+        return None
+    try:
+        return json.load(open(path))
+    except ValueError:
+        return None
+
+
+def diff_fact_objects(old, new):
+    delta = {}
+    added = dict((name, new[name]) for name in new if name not in old)
+    removed = [name for name in old if name not in new]
+    modified = {}
+    for name in new:
+        if name not in old or old[name] == new[name]:
+            continue
+        before = old[name]
+        after = new[name]
+        if isinstance(before, dict) and isinstance(after, dict):
+            modified[name] = dict((field, {'before': before.get(field),
+                                           'after': after.get(field)})
+                                  for field in set(before) | set(after)
+                                  if before.get(field) != after.get(field))
+        else:
+            modified[name] = {'before': before, 'after': after}
+    if added:
+        delta['added'] = added
+    if removed:
+        delta['removed'] = removed
+    if modified:
+        delta['modified'] = modified
+    return delta
+
+def diff_facts(old, new):
+    # round trip through JSON so values compare equal to the stored snapshot
+    new = json.loads(json.dumps(new))
+    result = {}
+    for category in new:
+        if category in FACT_GENERATORS:
+            delta = diff_fact_objects(old.get(category, {}), new[category])
+        elif old.get(category) != new[category]:
+            delta = {'before': old.get(category), 'after': new[category]}
+        else:
+            delta = None
+        if delta:
+            result[category] = delta
+    return result
+
+
+def generate_dict(api_obj, fields, query=None, category=None):
     result_dict = {}
-    lists = []
-    supported_fields = []
-    if api_obj.get_list():
-        for field in fields:
+    chunk_size = None
+    columnar = False
+    if query:
+        fields = query.select_fields(category, fields)
+        chunk_size = query.chunk_size
+        columnar = query.columnar
+    if columnar:
+        result_dict = {'names': [], 'fields': {}}
+    names = api_obj.get_list()
+    if not names:
+        return result_dict
+    if not chunk_size:
+        chunk_size = len(names)
+    supported_fields = list(fields)
+    # fetch each getter one chunk of objects at a time so that only a
+    # single chunk of SOAP responses is held in memory
+    for start in range(0, len(names), chunk_size):
+        chunk = names[start:start + chunk_size]
+        api_obj.set_list(chunk)
+        lists = []
+        for field in list(supported_fields):
             try:
                 api_response = getattr(api_obj, "get_" + field)()
-            except (MethodNotFound, WebFault):
-                pass
+            except MethodNotFound:
+                supported_fields.remove(field)
+                if query:
+                    query.mark_unsupported(category, field)
+            except WebFault:
+                # faults may be transient, so they are not recorded as
+                # unsupported and the getter is tried again on the next run
+                supported_fields.remove(field)
             else:
                 lists.append(api_response)
-                supported_fields.append(field)
-        for i, j in enumerate(api_obj.get_list()):
-            temp = {}
-            temp.update([(item[0], item[1][i]) for item in zip(supported_fields, lists)])
-            result_dict[j] = temp
+        if columnar:
+            # getters already return one array per field, keep that shape
+            result_dict['names'].extend(chunk)
+            for field, values in zip(supported_fields, lists):
+                result_dict['fields'].setdefault(field, []).extend(values)
+        else:
+            for i, name in enumerate(chunk):
+                result_dict[name] = dict([(item[0], item[1][i]) for item in zip(supported_fields, lists)])
+        del lists
+    if columnar:
+        # drop columns of getters that failed part way through
+        for field in result_dict['fields'].keys():
+            if field not in supported_fields:
+                del result_dict['fields'][field]
+    elif len(supported_fields) < len(fields):
+        # same for the objects of the chunks read before the getter failed,
+        # so that every object has the same keys
+        for obj in result_dict.values():
+            for field in fields:
+                if field not in supported_fields:
+                    obj.pop(field, None)
+    api_obj.set_list(names)
     return result_dict
 
-def generate_simple_dict(api_obj, fields):
+def merge_columnar(result, part):
+    if not result['names']:
+        return part
+    if not part['names']:
+        return result
+    for field in result['fields'].keys():
+        if field in part['fields']:
+            result['fields'][field].extend(part['fields'][field])
+        else:
+            del result['fields'][field]
+    result['names'].extend(part['names'])
+    return result
+
+def drop_partial_fields(facts):
+    # a getter failing in one scope only leaves its field on the objects of
+    # the other scopes; keep the fields that every object has
+    common = None
+    for obj in facts.values():
+        if common is None:
+            common = set(obj)
+        else:
+            common &= set(obj)
+    for obj in facts.values():
+        for field in obj.keys():
+            if field not in common:
+                del obj[field]
+    return facts
+
+def generate_simple_dict(api_obj, fields, query=None, category=None):
     result_dict = {}
+    if query:
+        fields = query.select_fields(category, fields)
     for field in fields:
         try:
             api_response = getattr(api_obj, "get_" + field)()
-        except (MethodNotFound, WebFault):
+        except MethodNotFound:
+            if query:
+                query.mark_unsupported(category, field)
+        except WebFault:
             pass
         else:
             result_dict[field] = api_response
     return result_dict
 
-def generate_interface_dict(f5, regex):
+# getters called for each fact category, which are also the names the
+# fields option accepts
+FACT_FIELDS = {
+    'interface': [
+        'active_media', 'actual_flow_control', 'bundle_state', 'description',
+        'dual_media_state', 'enabled_state', 'if_index', 'learning_mode',
+        'lldp_admin_status', 'lldp_tlvmap', 'mac_address', 'media',
+        'media_option', 'media_option_sfp', 'media_sfp', 'media_speed',
+        'media_status', 'mtu', 'phy_master_slave_mode', 'prefer_sfp_state',
+        'flow_control', 'sflow_poll_interval', 'sflow_poll_interval_global',
+        'sfp_media_state', 'stp_active_edge_port_state', 'stp_enabled_state',
+        'stp_link_type', 'stp_protocol_detection_reset_state',
+    ],
+    'self_ip': [
+        'address', 'allow_access_list', 'description',
+        'enforced_firewall_policy', 'floating_state', 'fw_rule', 'netmask',
+        'staged_firewall_policy', 'traffic_group', 'vlan',
+        'is_traffic_group_inherited',
+    ],
+    'trunk': [
+        'active_lacp_state', 'configured_member_count', 'description',
+        'distribution_hash_option', 'interface', 'lacp_enabled_state',
+        'lacp_timeout_option', 'link_selection_policy', 'media_speed',
+        'media_status', 'operational_member_count', 'stp_enabled_state',
+        'stp_protocol_detection_reset_state',
+    ],
+    'vlan': [
+        'auto_lasthop', 'cmp_hash_algorithm', 'description',
+        'dynamic_forwarding', 'failsafe_action', 'failsafe_state',
+        'failsafe_timeout', 'if_index', 'learning_mode',
+        'mac_masquerade_address', 'member', 'mtu', 'sflow_poll_interval',
+        'sflow_poll_interval_global', 'sflow_sampling_rate',
+        'sflow_sampling_rate_global', 'source_check_state', 'true_mac_address',
+        'vlan_id',
+    ],
+    'virtual_server': [
+        'actual_hardware_acceleration', 'authentication_profile',
+        'auto_lasthop', 'bw_controller_policy', 'clone_pool',
+        'cmp_enable_mode', 'connection_limit', 'connection_mirror_state',
+        'default_pool_name', 'description', 'destination', 'enabled_state',
+        'enforced_firewall_policy', 'fallback_persistence_profile', 'fw_rule',
+        'gtm_score', 'last_hop_pool', 'nat64_state', 'object_status',
+        'persistence_profile', 'profile', 'protocol', 'rate_class',
+        'rate_limit', 'rate_limit_destination_mask', 'rate_limit_mode',
+        'rate_limit_source_mask', 'related_rule', 'rule',
+        'security_log_profile', 'snat_pool', 'snat_type', 'source_address',
+        'source_address_translation_lsn_pool',
+        'source_address_translation_snat_pool',
+        'source_address_translation_type', 'source_port_behavior',
+        'staged_firewall_policy', 'translate_address_state',
+        'translate_port_state', 'type', 'vlan', 'wildmask',
+    ],
+    'pool': [
+        'action_on_service_down', 'active_member_count',
+        'aggregate_dynamic_ratio', 'allow_nat_state', 'allow_snat_state',
+        'client_ip_tos', 'client_link_qos', 'description',
+        'gateway_failsafe_device', 'ignore_persisted_weight_state',
+        'lb_method', 'member', 'minimum_active_member', 'minimum_up_member',
+        'minimum_up_member_action', 'minimum_up_member_enabled_state',
+        'monitor_association', 'monitor_instance', 'object_status', 'profile',
+        'queue_depth_limit', 'queue_on_connection_limit_state',
+        'queue_time_limit', 'reselect_tries', 'server_ip_tos',
+        'server_link_qos', 'simple_timeout', 'slow_ramp_time',
+    ],
+    'device': [
+        'active_modules', 'base_mac_address', 'blade_addresses', 'build',
+        'chassis_id', 'chassis_type', 'comment', 'configsync_address',
+        'contact', 'description', 'edition', 'failover_state', 'hostname',
+        'inactive_modules', 'location', 'management_address', 'marketing_name',
+        'multicast_address', 'optional_modules', 'platform_id',
+        'primary_mirror_address', 'product', 'secondary_mirror_address',
+        'software_version', 'timelimited_modules', 'timezone',
+        'unicast_addresses',
+    ],
+    'device_group': [
+        'all_preferred_active', 'autosync_enabled_state', 'description',
+        'device', 'full_load_on_sync_state',
+        'incremental_config_sync_size_maximum',
+        'network_failover_enabled_state', 'sync_status', 'type',
+    ],
+    'traffic_group': [
+        'auto_failback_enabled_state', 'auto_failback_time', 'default_device',
+        'description', 'ha_load_factor', 'ha_order', 'is_floating',
+        'mac_masquerade_address', 'unit_id',
+    ],
+    'rule': [
+        'definition', 'description', 'ignore_vertification',
+        'verification_status',
+    ],
+    'node': [
+        'address', 'connection_limit', 'description', 'dynamic_ratio',
+        'monitor_instance', 'monitor_rule', 'monitor_status', 'object_status',
+        'rate_limit', 'ratio', 'session_status',
+    ],
+    'virtual_address': [
+        'address', 'arp_state', 'auto_delete_state', 'connection_limit',
+        'description', 'enabled_state', 'icmp_echo_state', 'is_floating_state',
+        'netmask', 'object_status', 'route_advertisement_state',
+        'traffic_group',
+    ],
+    'address_class': [
+        'address_class', 'description',
+    ],
+    'client_ssl_profile': [
+        'alert_timeout', 'allow_nonssl_state', 'authenticate_depth',
+        'authenticate_once_state', 'ca_file', 'cache_size', 'cache_timeout',
+        'certificate_file', 'chain_file', 'cipher_list',
+        'client_certificate_ca_file', 'crl_file', 'default_profile',
+        'description', 'forward_proxy_ca_certificate_file',
+        'forward_proxy_ca_key_file', 'forward_proxy_ca_passphrase',
+        'forward_proxy_certificate_extension_include',
+        'forward_proxy_certificate_lifespan', 'forward_proxy_enabled_state',
+        'forward_proxy_lookup_by_ipaddr_port_state', 'handshake_timeout',
+        'key_file', 'modssl_emulation_state', 'passphrase',
+        'peer_certification_mode', 'profile_mode',
+        'renegotiation_maximum_record_delay', 'renegotiation_period',
+        'renegotiation_state', 'renegotiation_throughput',
+        'retain_certificate_state', 'secure_renegotiation_mode', 'server_name',
+        'session_ticket_state', 'sni_default_state', 'sni_require_state',
+        'ssl_option', 'strict_resume_state', 'unclean_shutdown_state',
+        'is_base_profile', 'is_system_profile',
+    ],
+    'system_info': [
+        'base_mac_address', 'blade_temperature', 'chassis_slot_information',
+        'globally_unique_identifier', 'group_id', 'hardware_information',
+        'marketing_name', 'product_information', 'pva_version', 'system_id',
+        'system_information', 'time', 'time_zone', 'uptime',
+    ],
+}
+
+def generate_interface_dict(f5, regex, query=None):
     interfaces = Interfaces(f5.get_api(), regex)
-    fields = ['active_media', 'actual_flow_control', 'bundle_state',
-              'description', 'dual_media_state', 'enabled_state', 'if_index',
-              'learning_mode', 'lldp_admin_status', 'lldp_tlvmap',
-              'mac_address', 'media', 'media_option', 'media_option_sfp',
-              'media_sfp', 'media_speed', 'media_status', 'mtu',
-              'phy_master_slave_mode', 'prefer_sfp_state', 'flow_control',
-              'sflow_poll_interval', 'sflow_poll_interval_global',
-              'sfp_media_state', 'stp_active_edge_port_state',
-              'stp_enabled_state', 'stp_link_type',
-              'stp_protocol_detection_reset_state']
-    return generate_dict(interfaces, fields)
-
-def generate_self_ip_dict(f5, regex):
+    return generate_dict(interfaces, FACT_FIELDS['interface'], query, 'interface')
+
+def generate_self_ip_dict(f5, regex, query=None):
     self_ips = SelfIPs(f5.get_api(), regex)
-    fields = ['address', 'allow_access_list', 'description',
-              'enforced_firewall_policy', 'floating_state', 'fw_rule',
-              'netmask', 'staged_firewall_policy', 'traffic_group',
-              'vlan', 'is_traffic_group_inherited']
-    return generate_dict(self_ips, fields)
+    return generate_dict(self_ips, FACT_FIELDS['self_ip'], query, 'self_ip')
 
-def generate_trunk_dict(f5, regex):
+def generate_trunk_dict(f5, regex, query=None):
     trunks = Trunks(f5.get_api(), regex)
-    fields = ['active_lacp_state', 'configured_member_count', 'description',
-              'distribution_hash_option', 'interface', 'lacp_enabled_state',
-              'lacp_timeout_option', 'link_selection_policy', 'media_speed',
-              'media_status', 'operational_member_count', 'stp_enabled_state',
-              'stp_protocol_detection_reset_state']
-    return generate_dict(trunks, fields)
-
-def generate_vlan_dict(f5, regex):
+    return generate_dict(trunks, FACT_FIELDS['trunk'], query, 'trunk')
+
+def generate_vlan_dict(f5, regex, query=None):
     vlans = Vlans(f5.get_api(), regex)
-    fields = ['auto_lasthop', 'cmp_hash_algorithm', 'description',
-              'dynamic_forwarding', 'failsafe_action', 'failsafe_state',
-              'failsafe_timeout', 'if_index', 'learning_mode',
-              'mac_masquerade_address', 'member', 'mtu',
-              'sflow_poll_interval', 'sflow_poll_interval_global',
-              'sflow_sampling_rate', 'sflow_sampling_rate_global',
-              'source_check_state', 'true_mac_address', 'vlan_id']
-    return generate_dict(vlans, fields)
-
-def generate_vs_dict(f5, regex):
+    return generate_dict(vlans, FACT_FIELDS['vlan'], query, 'vlan')
+
+def generate_vs_dict(f5, regex, query=None):
     virtual_servers = VirtualServers(f5.get_api(), regex)
-    fields = ['actual_hardware_acceleration', 'authentication_profile',
-              'auto_lasthop', 'bw_controller_policy', 'clone_pool',
-              'cmp_enable_mode', 'connection_limit', 'connection_mirror_state',
-              'default_pool_name', 'description', 'destination',
-              'enabled_state', 'enforced_firewall_policy',
-              'fallback_persistence_profile', 'fw_rule', 'gtm_score',
-              'last_hop_pool', 'nat64_state', 'object_status',
-              'persistence_profile', 'profile', 'protocol',
-              'rate_class', 'rate_limit', 'rate_limit_destination_mask',
-              'rate_limit_mode', 'rate_limit_source_mask', 'related_rule',
-              'rule', 'security_log_profile', 'snat_pool', 'snat_type',
-              'source_address', 'source_address_translation_lsn_pool',
-              'source_address_translation_snat_pool',
-              'source_address_translation_type', 'source_port_behavior',
-              'staged_firewall_policy', 'translate_address_state',
-              'translate_port_state', 'type', 'vlan', 'wildmask']
-    return generate_dict(virtual_servers, fields)
-
-def generate_pool_dict(f5, regex):
+    return generate_dict(virtual_servers, FACT_FIELDS['virtual_server'], query, 'virtual_server')
+
+def generate_pool_dict(f5, regex, query=None):
     pools = Pools(f5.get_api(), regex)
-    fields = ['action_on_service_down', 'active_member_count',
-              'aggregate_dynamic_ratio', 'allow_nat_state',
-              'allow_snat_state', 'client_ip_tos', 'client_link_qos',
-              'description', 'gateway_failsafe_device',
-              'ignore_persisted_weight_state', 'lb_method', 'member',
-              'minimum_active_member', 'minimum_up_member',
-              'minimum_up_member_action', 'minimum_up_member_enabled_state',
-              'monitor_association', 'monitor_instance', 'object_status',
-              'profile', 'queue_depth_limit',
-              'queue_on_connection_limit_state', 'queue_time_limit',
-              'reselect_tries', 'server_ip_tos', 'server_link_qos',
-              'simple_timeout', 'slow_ramp_time']
-    return generate_dict(pools, fields)
-
-def generate_device_dict(f5, regex):
+    return generate_dict(pools, FACT_FIELDS['pool'], query, 'pool')
+
+def generate_device_dict(f5, regex, query=None):
     devices = Devices(f5.get_api(), regex)
-    fields = ['active_modules', 'base_mac_address', 'blade_addresses',
-              'build', 'chassis_id', 'chassis_type', 'comment',
-              'configsync_address', 'contact', 'description', 'edition',
-              'failover_state', 'hostname', 'inactive_modules', 'location',
-              'management_address', 'marketing_name', 'multicast_address',
-              'optional_modules', 'platform_id', 'primary_mirror_address',
-              'product', 'secondary_mirror_address', 'software_version',
-              'timelimited_modules', 'timezone', 'unicast_addresses']
-    return generate_dict(devices, fields)
-
-def generate_device_group_dict(f5, regex):
+    return generate_dict(devices, FACT_FIELDS['device'], query, 'device')
+
+def generate_device_group_dict(f5, regex, query=None):
     device_groups = DeviceGroups(f5.get_api(), regex)
-    fields = ['all_preferred_active', 'autosync_enabled_state','description',
-              'device', 'full_load_on_sync_state',
-              'incremental_config_sync_size_maximum',
-              'network_failover_enabled_state', 'sync_status', 'type']
-    return generate_dict(device_groups, fields)
+    return generate_dict(device_groups, FACT_FIELDS['device_group'], query, 'device_group')
 
-def generate_traffic_group_dict(f5, regex):
+def generate_traffic_group_dict(f5, regex, query=None):
     traffic_groups = TrafficGroups(f5.get_api(), regex)
-    fields = ['auto_failback_enabled_state', 'auto_failback_time',
-              'default_device', 'description', 'ha_load_factor',
-              'ha_order', 'is_floating', 'mac_masquerade_address',
-              'unit_id']
-    return generate_dict(traffic_groups, fields)
+    return generate_dict(traffic_groups, FACT_FIELDS['traffic_group'], query, 'traffic_group')
 
-def generate_rule_dict(f5, regex):
+def generate_rule_dict(f5, regex, query=None):
     rules = Rules(f5.get_api(), regex)
-    fields = ['definition', 'description', 'ignore_vertification',
-              'verification_status']
-    return generate_dict(rules, fields)
+    return generate_dict(rules, FACT_FIELDS['rule'], query, 'rule')
 
-def generate_node_dict(f5, regex):
+def generate_node_dict(f5, regex, query=None):
     nodes = Nodes(f5.get_api(), regex)
-    fields = ['address', 'connection_limit', 'description', 'dynamic_ratio',
-              'monitor_instance', 'monitor_rule', 'monitor_status',
-              'object_status', 'rate_limit', 'ratio', 'session_status']
-    return generate_dict(nodes, fields)
+    return generate_dict(nodes, FACT_FIELDS['node'], query, 'node')
 
-def generate_virtual_address_dict(f5, regex):
+def generate_virtual_address_dict(f5, regex, query=None):
     virtual_addresses = VirtualAddresses(f5.get_api(), regex)
-    fields = ['address', 'arp_state', 'auto_delete_state', 'connection_limit',
-              'description', 'enabled_state', 'icmp_echo_state',
-              'is_floating_state', 'netmask', 'object_status',
-              'route_advertisement_state', 'traffic_group']
-    return generate_dict(virtual_addresses, fields)
+    return generate_dict(virtual_addresses, FACT_FIELDS['virtual_address'], query, 'virtual_address')
 
-def generate_address_class_dict(f5, regex):
+def generate_address_class_dict(f5, regex, query=None):
     address_classes = AddressClasses(f5.get_api(), regex)
-    fields = ['address_class', 'description']
-    return generate_dict(address_classes, fields)
+    return generate_dict(address_classes, FACT_FIELDS['address_class'], query, 'address_class')
 
-def generate_certificate_dict(f5, regex):
+def generate_certificate_dict(f5, regex, query=None):
     certificates = Certificates(f5.get_api(), regex)
     return dict(zip(certificates.get_list(), certificates.get_certificate_list()))
 
-def generate_key_dict(f5, regex):
+def generate_key_dict(f5, regex, query=None):
     keys = Keys(f5.get_api(), regex)
     return dict(zip(keys.get_list(), keys.get_key_list()))
 
-def generate_client_ssl_profile_dict(f5, regex):
+def generate_client_ssl_profile_dict(f5, regex, query=None):
     profiles = ProfileClientSSL(f5.get_api(), regex)
-    fields = ['alert_timeout', 'allow_nonssl_state', 'authenticate_depth',
-              'authenticate_once_state', 'ca_file', 'cache_size',
-              'cache_timeout', 'certificate_file', 'chain_file',
-              'cipher_list', 'client_certificate_ca_file', 'crl_file',
-              'default_profile', 'description',
-              'forward_proxy_ca_certificate_file', 'forward_proxy_ca_key_file',
-              'forward_proxy_ca_passphrase',
-              'forward_proxy_certificate_extension_include',
-              'forward_proxy_certificate_lifespan',
-              'forward_proxy_enabled_state',
-              'forward_proxy_lookup_by_ipaddr_port_state', 'handshake_timeout',
-              'key_file', 'modssl_emulation_state', 'passphrase',
-              'peer_certification_mode', 'profile_mode',
-              'renegotiation_maximum_record_delay', 'renegotiation_period',
-              'renegotiation_state', 'renegotiation_throughput',
-              'retain_certificate_state', 'secure_renegotiation_mode',
-              'server_name', 'session_ticket_state', 'sni_default_state',
-              'sni_require_state', 'ssl_option', 'strict_resume_state',
-              'unclean_shutdown_state', 'is_base_profile', 'is_system_profile']
-    return generate_dict(profiles, fields)
-
-def generate_system_info_dict(f5):
+    return generate_dict(profiles, FACT_FIELDS['client_ssl_profile'], query, 'client_ssl_profile')
+
+def generate_system_info_dict(f5, query=None):
     system_info = SystemInfo(f5.get_api())
-    fields = ['base_mac_address',
-              'blade_temperature', 'chassis_slot_information',
-              'globally_unique_identifier', 'group_id',
-              'hardware_information',
-              'marketing_name',
-              'product_information', 'pva_version', 'system_id',
-              'system_information', 'time',
-              'time_zone', 'uptime']
-    return generate_simple_dict(system_info, fields)
+    return generate_simple_dict(system_info, FACT_FIELDS['system_info'], query, 'system_info')
 
 def generate_software_list(f5):
     software = Software(f5.get_api())
@@ -1567,25 +2265,418 @@ def generate_software_list(f5):
     return software_list
 
 
+def iter_chunks(api_obj, query=None):
+    names = api_obj.get_list()
+    chunk_size = (query and query.chunk_size) or max(len(names), 1)
+    for start in range(0, len(names), chunk_size):
+        api_obj.set_list(names[start:start + chunk_size])
+        yield
+    api_obj.set_list(names)
+
+def decode_statistics(statistics, stat_types=None):
+    result = {}
+    for stat in statistics:
+        if stat_types and stat['type'] not in stat_types:
+            continue
+        # iControl splits 64-bit counters into high and low 32-bit words
+        result[stat['type']] = (long(stat['value']['high']) << 32) | \
+                               long(stat['value']['low'])
+    return result
+
+def generate_pool_stats_dict(f5, regex, query=None):
+    pools = Pools(f5.get_api(), regex)
+    stat_types = query and query.fields.get('pool_stats')
+    result = {}
+    for chunk in iter_chunks(pools, query):
+        for entry in pools.get_statistics()['statistics']:
+            result[entry['pool_name']] = decode_statistics(entry['statistics'],
+                                                           stat_types)
+    return result
+
+def generate_pool_member_stats_dict(f5, regex, query=None):
+    pools = Pools(f5.get_api(), regex)
+    stat_types = query and query.fields.get('pool_member_stats')
+    result = {}
+    for chunk in iter_chunks(pools, query):
+        member_stats = pools.get_all_member_statistics()
+        for pool, stats in zip(pools.get_list(), member_stats):
+            members = result.setdefault(pool, {})
+            for entry in stats['statistics']:
+                member = "%s:%s" % (entry['member']['address'],
+                                    entry['member']['port'])
+                members[member] = decode_statistics(entry['statistics'],
+                                                    stat_types)
+    return result
+
+def generate_vs_stats_dict(f5, regex, query=None):
+    virtual_servers = VirtualServers(f5.get_api(), regex)
+    stat_types = query and query.fields.get('virtual_server_stats')
+    result = {}
+    for chunk in iter_chunks(virtual_servers, query):
+        for entry in virtual_servers.get_statistics()['statistics']:
+            name = entry['virtual_server']['name']
+            result[name] = decode_statistics(entry['statistics'], stat_types)
+    return result
+
+def compute_rates(previous, current, interval):
+    if isinstance(current, dict):
+        result = {}
+        for key in current:
+            if key in previous:
+                rate = compute_rates(previous[key], current[key], interval)
+                if rate is not None:
+                    result[key] = rate
+        return result
+    if isinstance(current, (int, long)) and isinstance(previous, (int, long)) \
+       and current >= previous and interval > 0:
+        return round((current - previous) / interval, 3)
+    # counter was reset or is not numeric
+    return None
+
+def add_stats_rates(facts, sample_file):
+    now = time.time()
+    previous = None
+    if os.path.exists(sample_file):
+        try:
+            previous = json.load(open(sample_file))
+        except ValueError:
+            pass
+    samples = dict((category, facts[category]) for category in STATS_CATEGORIES
+                   if category in facts)
+    if previous:
+        interval = now - previous['time']
+        for category in samples:
+            if category in previous['facts']:
+                facts[category + '_rate'] = compute_rates(
+                    previous['facts'][category], samples[category], interval)
+    write_json_file(sample_file, {'time': now, 'facts': samples})
+
+
+FACT_GENERATORS = {
+    'address_class': generate_address_class_dict,
+    'certificate': generate_certificate_dict,
+    'client_ssl_profile': generate_client_ssl_profile_dict,
+    'device': generate_device_dict,
+    'device_group': generate_device_group_dict,
+    'interface': generate_interface_dict,
+    'key': generate_key_dict,
+    'node': generate_node_dict,
+    'pool': generate_pool_dict,
+    'pool_member_stats': generate_pool_member_stats_dict,
+    'pool_stats': generate_pool_stats_dict,
+    'rule': generate_rule_dict,
+    'self_ip': generate_self_ip_dict,
+    'traffic_group': generate_traffic_group_dict,
+    'trunk': generate_trunk_dict,
+    'virtual_address': generate_virtual_address_dict,
+    'virtual_server': generate_vs_dict,
+    'virtual_server_stats': generate_vs_stats_dict,
+    'vlan': generate_vlan_dict,
+}
+
+# categories of objects that live in partitions and can be queried per folder
+FOLDER_CATEGORIES = ('address_class', 'client_ssl_profile', 'node', 'pool',
+                     'pool_member_stats', 'pool_stats', 'rule', 'self_ip',
+                     'virtual_address', 'virtual_server',
+                     'virtual_server_stats', 'vlan')
+
+# statistics categories, which are always returned as dicts of counters
+STATS_CATEGORIES = ('pool_member_stats', 'pool_stats', 'virtual_server_stats')
+
+def generate_facts(f5, category, regex, query=None):
+    if category == 'software':
+        return generate_software_list(f5)
+    if category == 'system_info':
+        return generate_system_info_dict(f5, query)
+    if query and category in FOLDER_CATEGORIES:
+        scopes = query.scopes
+    else:
+        scopes = [("/", True)]
+    facts = {}
+    for folder, recursive in scopes:
+        f5.set_query_scope(folder, recursive)
+        part = FACT_GENERATORS[category](f5, regex, query)
+        if query and query.columnar and facts and \
+           category not in STATS_CATEGORIES:
+            facts = merge_columnar(facts, part)
+        else:
+            facts.update(part)
+    if len(scopes) > 1 and not (query and query.columnar) and \
+       category not in STATS_CATEGORIES:
+        facts = drop_partial_fields(facts)
+    return facts
+
+def get_filter_folder(fact_filter):
+    # longest literal folder path preceding the first glob character
+    match = re.match(r'^(/[^*?\[]*)/', fact_filter)
+    if match:
+        return match.group(1)
+    return None
+
+def collect_category(f5, category, regex, query, facts, writer=None):
+    start = time.time()
+    category_facts = generate_facts(f5, category, regex, query)
+    if writer:
+        if query and query.columnar and category not in STATS_CATEGORIES:
+            count = len(category_facts['names'])
+        else:
+            count = len(category_facts)
+        writer.write(category, category_facts, count, time.time() - start)
+    else:
+        facts[category] = category_facts
+
+def collect_facts(f5, include, regex, query=None, writer=None):
+    facts = {}
+    for category in include:
+        collect_category(f5, category, regex, query, facts, writer)
+    return facts
+
+def collect_facts_parallel(server, user, password, include, regex, workers,
+                           query=None, writer=None, wsdl_cache_dir=None):
+    pending = Queue.Queue()
+    for category in include:
+        pending.put(category)
+    facts = {}
+    errors = []
+
+    def worker():
+        try:
+            # every worker needs its own session so that the active folder
+            # and recursive query state are not shared between threads
+            f5 = F5(server, user, password, session=True,
+                    wsdl_cache_dir=wsdl_cache_dir)
+            while not errors:
+                try:
+                    category = pending.get_nowait()
+                except Queue.Empty:
+                    break
+                collect_category(f5, category, regex, query, facts, writer)
+        except Exception:
+            errors.append(sys.exc_info())
+
+    threads = [threading.Thread(target=worker)
+               for i in range(min(workers, len(include)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return facts
+
+
+def collect_device_facts(server, include, regex, params):
+    user = params['user']
+    password = params['password']
+    session = params['session']
+    workers = params['workers']
+    fields = params['fields']
+    method_cache = params['method_cache']
+    chunk_size = params['chunk_size']
+    partitions = params['partitions']
+    cache_dir = params['cache_dir']
+    cache_ttl = params['cache_ttl']
+    cache_device_group = params['cache_device_group']
+    diff_snapshot = params['diff_snapshot']
+    columnar = params['output_format'] == 'columnar'
+    dest = params['dest']
+    stats_sample_file = params['stats_sample_file']
+    fact_filter = params['filter']
+    wsdl_cache_dir = params['wsdl_cache_dir']
+    session_cache = params['session_cache']
+    session_ttl = params['session_ttl']
+
+    facts = {}
+    cached = False
+
+    if len(include) > 0:
+        session_id = None
+        if session and session_cache:
+            session_id = load_session_id(session_cache, server, user,
+                                         session_ttl)
+        f5 = F5(server, user, password, session, wsdl_cache_dir, session_id)
+        saved_active_folder = None
+
+        # statistics are always collected live, only the configuration
+        # categories go through the snapshot cache
+        config_include = [x for x in include if x not in STATS_CATEGORIES]
+        snapshot = None
+        marker = None
+        if cache_dir and config_include:
+            snapshot_path = get_snapshot_path(cache_dir, [server, user,
+                sorted(config_include), fact_filter, fields, partitions,
+                columnar])
+            if cache_device_group:
+                saved_active_folder = f5.check_session()
+                marker = get_config_marker(f5, cache_device_group)
+            snapshot = load_snapshot(snapshot_path, cache_ttl)
+
+        if snapshot is not None and snapshot.get('marker') == marker:
+            facts = snapshot['facts']
+            cached = True
+            include = [x for x in include if x in STATS_CATEGORIES]
+
+        if include:
+            if saved_active_folder is None:
+                saved_active_folder = f5.check_session()
+            saved_recursive_query_state = f5.get_recursive_query_state()
+            f5.set_query_scope("/", True)
+
+            if partitions:
+                scopes = [("/" + x.strip("/"), False) for x in partitions]
+            else:
+                scopes = [("/", True)]
+                filter_folder = fact_filter and get_filter_folder(fact_filter)
+                if filter_folder:
+                    try:
+                        f5.set_query_scope(filter_folder, True)
+                    except WebFault:
+                        # not a folder; fall back to scanning from the root
+                        pass
+                    else:
+                        scopes = [(filter_folder, True)]
+
+            query = FactQuery(fields, chunk_size=chunk_size, scopes=scopes,
+                              columnar=columnar)
+            if method_cache:
+                version = get_version_key(f5)
+                query.unsupported = load_method_cache(method_cache, version)
+
+            writer = None
+            if dest:
+                writer = FactWriter(dest)
+            start = time.time()
+            try:
+                if workers > 1:
+                    facts.update(collect_facts_parallel(server, user, password,
+                                                        include, regex, workers,
+                                                        query, writer,
+                                                        wsdl_cache_dir))
+                else:
+                    facts.update(collect_facts(f5, include, regex, query,
+                                               writer))
+            finally:
+                if writer:
+                    writer.close()
+
+            if method_cache and query.changed:
+                save_method_cache(method_cache, version, query.unsupported)
+
+            # restore saved state
+            if saved_active_folder and \
+               saved_active_folder != f5.active_folder:
+                f5.set_active_folder(saved_active_folder)
+            if saved_recursive_query_state and \
+               saved_recursive_query_state != f5.recursive_query_state:
+                f5.set_recursive_query_state(saved_recursive_query_state)
+
+            if cache_dir and config_include and not cached:
+                write_json_file(snapshot_path,
+                                {'marker': marker,
+                                 'facts': dict((x, facts[x]) for x in config_include
+                                               if x in facts)})
+
+        if session and session_cache and f5.session_id != session_id:
+            save_session_id(session_cache, server, user, f5.session_id)
+
+    if stats_sample_file:
+        add_stats_rates(facts, stats_sample_file)
+
+    if diff_snapshot:
+        previous = {}
+        if os.path.exists(diff_snapshot):
+            f = open(diff_snapshot)
+            try:
+                previous = json.load(f)
+            except ValueError:
+                # a truncated snapshot is treated as missing
+                pass
+            finally:
+                f.close()
+        write_json_file(diff_snapshot, facts)
+        facts = {'bigip_diff': diff_facts(previous, facts)}
+
+    if dest:
+        result = {'changed': True, 'dest': dest,
+                  'categories': writer.summary,
+                  'elapsed': round(time.time() - start, 3)}
+    else:
+        result = {'ansible_facts': facts}
+    if cache_dir:
+        result['cached'] = cached
+
+    return result
+
+def collect_facts_fanout(servers, include, regex, params, max_concurrency):
+    pending = Queue.Queue()
+    for server in servers:
+        pending.put(server)
+    results = {}
+    failures = {}
+
+    def worker():
+        while True:
+            try:
+                server = pending.get_nowait()
+            except Queue.Empty:
+                break
+            try:
+                results[server] = collect_device_facts(server, include,
+                                                       regex, params)
+            except Exception, e:
+                failures[server] = "received exception: %s" % e
+
+    threads = [threading.Thread(target=worker)
+               for i in range(min(max_concurrency, len(servers)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, failures
+
+
 def main():
     module = AnsibleModule(
         argument_spec = dict(
-            server = dict(type='str', required=True),
+            server = dict(type='list', required=True),
             user = dict(type='str', required=True),
             password = dict(type='str', required=True),
             session = dict(type='bool', default=False),
             include = dict(type='list', required=True),
             filter = dict(type='str', required=False),
+            workers = dict(type='int', default=1),
+            fields = dict(type='dict', required=False),
+            method_cache = dict(type='str', required=False),
+            chunk_size = dict(type='int', required=False),
+            partitions = dict(type='list', required=False),
+            cache_dir = dict(type='str', required=False),
+            cache_ttl = dict(type='int', default=300),
+            cache_device_group = dict(type='str', required=False),
+            diff_snapshot = dict(type='str', required=False),
+            output_format = dict(type='str', default='dict',
+                                 choices=['dict', 'columnar']),
+            dest = dict(type='str', required=False),
+            max_concurrency = dict(type='int', default=10),
+            stats_sample_file = dict(type='str', required=False),
+            wsdl_cache_dir = dict(type='str', required=False),
+            session_cache = dict(type='str', required=False),
+            session_ttl = dict(type='int', default=600),
         )
     )
 
     if not bigsuds_found:
         module.fail_json(msg="the python suds and bigsuds modules is required")
 
-    server = module.params['server']
-    user = module.params['user']
-    password = module.params['password']
-    session = module.params['session']
+    servers = module.params['server']
+    max_concurrency = module.params['max_concurrency']
+    workers = module.params['workers']
+    fields = module.params['fields'] or {}
+    chunk_size = module.params['chunk_size']
+    cache_dir = module.params['cache_dir']
+    diff_snapshot = module.params['diff_snapshot']
+    columnar = module.params['output_format'] == 'columnar'
+    dest = module.params['dest']
+    stats_sample_file = module.params['stats_sample_file']
     fact_filter = module.params['filter']
     if fact_filter:
         regex = fnmatch.translate(fact_filter)
@@ -1594,70 +2685,65 @@ def main():
     include = map(lambda x: x.lower(), module.params['include'])
     valid_includes = ('address_class', 'certificate', 'client_ssl_profile',
                       'device_group', 'interface', 'key', 'node', 'pool',
-                      'rule', 'self_ip', 'software', 'system_info',
-                      'traffic_group', 'trunk', 'virtual_address',
-                      'virtual_server', 'vlan')
+                      'pool_member_stats', 'pool_stats', 'rule', 'self_ip',
+                      'software', 'system_info', 'traffic_group', 'trunk',
+                      'virtual_address', 'virtual_server',
+                      'virtual_server_stats', 'vlan')
     include_test = map(lambda x: x in valid_includes, include)
     if not all(include_test):
         module.fail_json(msg="value of include must be one or more of: %s, got: %s" % (",".join(valid_includes), ",".join(include)))
+    include = list(set(include))
+    if workers < 1:
+        module.fail_json(msg="value of workers must be 1 or greater")
+    if chunk_size is not None and chunk_size < 1:
+        module.fail_json(msg="value of chunk_size must be 1 or greater")
+    if columnar and diff_snapshot:
+        module.fail_json(msg="diff_snapshot requires the dict output_format")
+    if dest and (cache_dir or diff_snapshot):
+        module.fail_json(msg="dest cannot be combined with cache_dir or diff_snapshot")
+    if len(servers) > 1 and (dest or diff_snapshot or stats_sample_file):
+        module.fail_json(msg="dest, diff_snapshot and stats_sample_file require a single server")
+    if dest and stats_sample_file:
+        module.fail_json(msg="dest cannot be combined with stats_sample_file")
+    if max_concurrency < 1:
+        module.fail_json(msg="value of max_concurrency must be 1 or greater")
+    for category, category_fields in fields.items():
+        if category not in valid_includes:
+            module.fail_json(msg="keys of fields must be fact categories, got: %s" % category)
+        if not isinstance(category_fields, list):
+            fields[category] = [x.strip() for x in str(category_fields).split(',')]
+        # statistics categories take statistic types, which are not checked
+        if category in FACT_FIELDS:
+            unknown = [x for x in fields[category] if x not in FACT_FIELDS[category]]
+            if unknown:
+                module.fail_json(msg="unknown fields for %s: %s, must be one or more of: %s" %
+                                 (category, ",".join(unknown), ",".join(FACT_FIELDS[category])))
+
+    params = dict(module.params)
+    params['fields'] = fields
+    for name in ('cache_dir', 'dest', 'diff_snapshot', 'method_cache',
+                 'session_cache', 'stats_sample_file', 'wsdl_cache_dir'):
+        if params[name]:
+            params[name] = os.path.expanduser(params[name])
+    if params['cache_dir'] and not os.path.isdir(params['cache_dir']):
+        os.makedirs(params['cache_dir'])
 
     try:
-        facts = {}
-
-        if len(include) > 0:
-            f5 = F5(server, user, password, session)
-            saved_active_folder = f5.get_active_folder()
-            saved_recursive_query_state = f5.get_recursive_query_state()
-            if saved_active_folder != "/":
-                f5.set_active_folder("/")
-            if saved_recursive_query_state != "STATE_ENABLED":
-                f5.enable_recursive_query_state()
-
-            if 'interface' in include:
-                facts['interface'] = generate_interface_dict(f5, regex)
-            if 'self_ip' in include:
-                facts['self_ip'] = generate_self_ip_dict(f5, regex)
-            if 'trunk' in include:
-                facts['trunk'] = generate_trunk_dict(f5, regex)
-            if 'vlan' in include:
-                facts['vlan'] = generate_vlan_dict(f5, regex)
-            if 'virtual_server' in include:
-                facts['virtual_server'] = generate_vs_dict(f5, regex)
-            if 'pool' in include:
-                facts['pool'] = generate_pool_dict(f5, regex)
-            if 'device' in include:
-                facts['device'] = generate_device_dict(f5, regex)
-            if 'device_group' in include:
-                facts['device_group'] = generate_device_group_dict(f5, regex)
-            if 'traffic_group' in include:
-                facts['traffic_group'] = generate_traffic_group_dict(f5, regex)
-            if 'rule' in include:
-                facts['rule'] = generate_rule_dict(f5, regex)
-            if 'node' in include:
-                facts['node'] = generate_node_dict(f5, regex)
-            if 'virtual_address' in include:
-                facts['virtual_address'] = generate_virtual_address_dict(f5, regex)
-            if 'address_class' in include:
-                facts['address_class'] = generate_address_class_dict(f5, regex)
-            if 'software' in include:
-                facts['software'] = generate_software_list(f5)
-            if 'certificate' in include:
-                facts['certificate'] = generate_certificate_dict(f5, regex)
-            if 'key' in include:
-                facts['key'] = generate_key_dict(f5, regex)
-            if 'client_ssl_profile' in include:
-                facts['client_ssl_profile'] = generate_client_ssl_profile_dict(f5, regex)
-            if 'system_info' in include:
-                facts['system_info'] = generate_system_info_dict(f5)
-
-            # restore saved state
-            if saved_active_folder and saved_active_folder != "/":
-                f5.set_active_folder(saved_active_folder)
-            if saved_recursive_query_state and \
-               saved_recursive_query_state != "STATE_ENABLED":
-                f5.set_recursive_query_state(saved_recursive_query_state)
-
-        result = {'ansible_facts': facts}
+        if len(servers) == 1:
+            result = collect_device_facts(servers[0], include, regex, params)
+        else:
+            results, failures = collect_facts_fanout(servers, include, regex,
+                                                     params, max_concurrency)
+            if not results:
+                module.fail_json(msg="failed to collect facts from all devices",
+                                 failed_devices=failures)
+            devices = dict((server, results[server]['ansible_facts'])
+                           for server in results)
+            result = {'ansible_facts': {'bigip_devices': devices},
+                      'failed_devices': failures}
+            if params['cache_dir']:
+                result['cached'] = dict((server, results[server]['cached'])
+                                        for server in results)
 
     except Exception, e:
         module.fail_json(msg="received exception: %s\ntraceback: %s" % (e, traceback.format_exc()))
@@ -57,8 +57,8 @@ options:
         choices: ['present', 'absent']
     name:
         description:
-            - Monitor name
-        required: true
+            - Monitor name. Required unless C(monitors) is used.
+        required: false
         default: null
         aliases: ['monitor']
     partition:
@@ -131,6 +131,24 @@ options:
               from the node. The default API setting is 0.
         required: false
         default: none
+    wsdl_cache_dir:
+        description:
+            - Directory in which the parsed iControl WSDLs are cached, in one
+              subdirectory per host and software version, so that later runs do
+              not download and parse them again. Finding the software version
+              costs one extra get_version call, through a second client, on
+              each run.
+        required: false
+        default: none
+        version_added: "2.0"
+    monitors:
+        description:
+            - List of monitors to manage in one run, instead of C(name). Each
+              item is a dictionary with a C(name) key and any of the other
+              monitor options, which default to the module level values.
+        required: false
+        default: none
+        version_added: "2.0"
 '''
 
 EXAMPLES = '''
@@ -170,9 +188,25 @@ EXAMPLES = '''
   with_flattened:
   - f5monitors-tcp
   - f5monitors-halftcp
+- name: BIGIP F5 | Create several TCP Monitors in one task
+  local_action:
+    module:             bigip_monitor_tcp
+    state:              present
+    server:             "{{ f5server }}"
+    user:               "{{ f5user }}"
+    password:           "{{ f5password }}"
+    monitors:
+    - name: app1-tcp
+      type: tcp
+      send: "PING"
+      receive: "PONG"
+    - name: app1-tcp-half-open
+      type: tcp_half_open
 
 '''
 
+import os
+
 try:
     import bigsuds
 except ImportError:
@@ -190,9 +224,23 @@ DEFAULT_PARENT = DEFAULT_TEMPLATE_TYPE_CHOICE = DEFAULT_TEMPLATE_TYPE.replace('T
 # these should be re-useable for other monitor types
 #
 
-def bigip_api(bigip, user, password):
-
-    api = bigsuds.BIGIP(hostname=bigip, username=user, password=password)
+def wsdl_cache_path(bigip, user, password, wsdl_cache_dir):
+    hostdir = os.path.join(os.path.expanduser(wsdl_cache_dir), bigip)
+    # the lookup only relies on SystemInfo.get_version existing on every
+    # release; its WSDL stays in the host directory, which suds expires after
+    # a day like the rest of its cache
+    api = bigsuds.BIGIP(hostname=bigip, username=user, password=password,
+                        cachedir=hostdir)
+    version = api.System.SystemInfo.get_version()
+    return os.path.join(hostdir, version.replace(os.sep, '_'))
+
+def bigip_api(bigip, user, password, wsdl_cache_dir=None):
+
+    cachedir = None
+    if wsdl_cache_dir:
+        cachedir = wsdl_cache_path(bigip, user, password, wsdl_cache_dir)
+    api = bigsuds.BIGIP(hostname=bigip, username=user, password=password,
+                        cachedir=cachedir)
     return api
 
 
@@ -243,56 +291,64 @@ def delete_monitor(api, monitor):
     return True
 
 
-def check_string_property(api, monitor, str_property):
+def get_string_properties(api, monitor, str_properties):
 
+    types = [x['type'] for x in str_properties]
     try:
-        return str_property == api.LocalLB.Monitor.get_template_string_property([monitor], [str_property['type']])[0]
+        return api.LocalLB.Monitor.get_template_string_property([monitor] * len(types), types)
     except bigsuds.OperationFailed, e:
         # happens in check mode if not created yet
         if "was not found" in str(e):
-            return True
+            return str_properties
         else:
             # genuine exception
             raise
-    return True
 
 
-def set_string_property(api, monitor, str_property):
+def set_string_properties(api, monitor, str_properties):
 
-    api.LocalLB.Monitor.set_template_string_property(template_names=[monitor], values=[str_property])
+    api.LocalLB.Monitor.set_template_string_property(template_names=[monitor] * len(str_properties), values=str_properties)
 
 
-def check_integer_property(api, monitor, int_property):
+def get_integer_properties(api, monitor, int_properties):
 
+    types = [x['type'] for x in int_properties]
     try:
-        return int_property == api.LocalLB.Monitor.get_template_integer_property([monitor], [int_property['type']])[0]
+        return api.LocalLB.Monitor.get_template_integer_property([monitor] * len(types), types)
     except bigsuds.OperationFailed, e:
         # happens in check mode if not created yet
         if "was not found" in str(e):
-            return True
+            return int_properties
         else:
             # genuine exception
             raise
-    return True
 
 
-def set_integer_property(api, monitor, int_property):
+def set_integer_properties(api, monitor, int_properties):
 
-    api.LocalLB.Monitor.set_template_int_property(template_names=[monitor], values=[int_property])
+    api.LocalLB.Monitor.set_template_int_property(template_names=[monitor] * len(int_properties), values=int_properties)
 
 
 def update_monitor_properties(api, module, monitor, template_string_properties, template_integer_properties):
 
+    # read every property with a single call per property kind, compare
+    # locally and write back all changed values with a single call
     changed = False
-    for str_property in template_string_properties:
-        if str_property['value'] is not None and not check_string_property(api, monitor, str_property):
+    str_properties = [x for x in template_string_properties if x['value'] is not None]
+    if str_properties:
+        current = get_string_properties(api, monitor, str_properties)
+        changed_str = [x for x, y in zip(str_properties, current) if x != y]
+        if changed_str:
             if not module.check_mode:
-                set_string_property(api, monitor, str_property)
+                set_string_properties(api, monitor, changed_str)
             changed = True
-    for int_property in template_integer_properties:
-        if int_property['value'] is not None and not check_integer_property(api, monitor, int_property):
+    int_properties = [x for x in template_integer_properties if x['value'] is not None]
+    if int_properties:
+        current = get_integer_properties(api, monitor, int_properties)
+        changed_int = [x for x, y in zip(int_properties, current) if x != y]
+        if changed_int:
             if not module.check_mode:
-                set_integer_property(api, monitor, int_property)
+                set_integer_properties(api, monitor, changed_int)
             changed = True
 
     return changed
@@ -319,52 +375,28 @@ def set_ipport(api, monitor, ipport):
 # ===========================================
 # main loop
 #
-# writing a module for other monitor types should 
-# only need an updated main() (and monitor specific functions)
+# writing a module for other monitor types should
+# only need an updated main() and manage_monitor() (and monitor
+# specific functions)
 
-def main():
+def manage_monitor(module, api, params):
 
     # begin monitor specific stuff
 
-    module = AnsibleModule(
-        argument_spec = dict(
-            server    = dict(required=True),
-            user      = dict(required=True),
-            password  = dict(required=True),
-            partition = dict(default='Common'),
-            state     = dict(default='present', choices=['present', 'absent']),
-            name      = dict(required=True),
-            type      = dict(default=DEFAULT_TEMPLATE_TYPE_CHOICE, choices=TEMPLATE_TYPE_CHOICES),
-            parent    = dict(default=DEFAULT_PARENT),
-            parent_partition = dict(default='Common'),
-            send      = dict(required=False),
-            receive   = dict(required=False),
-            ip        = dict(required=False),
-            port      = dict(required=False, type='int'),
-            interval  = dict(required=False, type='int'),
-            timeout   = dict(required=False, type='int'),
-            time_until_up = dict(required=False, type='int', default=0)
-        ),
-        supports_check_mode=True
-    )
-
-    server = module.params['server']
-    user = module.params['user']
-    password = module.params['password']
-    partition = module.params['partition']
-    parent_partition = module.params['parent_partition']
-    state = module.params['state']
-    name = module.params['name']
-    type = 'TTYPE_' + module.params['type'].upper()
-    parent = "/%s/%s" % (parent_partition, module.params['parent'])
+    partition = params['partition']
+    parent_partition = params['parent_partition']
+    state = params['state']
+    name = params['name']
+    type = 'TTYPE_' + params['type'].upper()
+    parent = "/%s/%s" % (parent_partition, params['parent'])
     monitor = "/%s/%s" % (partition, name)
-    send = module.params['send']
-    receive = module.params['receive']
-    ip = module.params['ip']
-    port = module.params['port']
-    interval = module.params['interval']
-    timeout = module.params['timeout']
-    time_until_up = module.params['time_until_up']
+    send = params['send']
+    receive = params['receive']
+    ip = params['ip']
+    port = params['port']
+    interval = params['interval']
+    timeout = params['timeout']
+    time_until_up = params['time_until_up']
 
     # tcp monitor has multiple types, so overrule
     global TEMPLATE_TYPE
@@ -372,9 +404,6 @@ def main():
 
     # end monitor specific stuff
 
-    if not bigsuds_found:
-        module.fail_json(msg="the python bigsuds module is required")
-    api = bigip_api(server, user, password)
     monitor_exists = check_monitor_exists(module, api, monitor, parent)
 
 
@@ -386,17 +415,17 @@ def main():
         if port is None:
             port = cur_ipport['ipport']['port']
     else: # use API defaults if not defined to create it
-        if interval is None:        
+        if interval is None:
             interval = 5
-        if timeout is None:         
+        if timeout is None:
             timeout = 16
-        if ip is None:              
+        if ip is None:
             ip = '0.0.0.0'
-        if port is None:            
+        if port is None:
             port = 0
-        if send is None:            
+        if send is None:
             send = ''
-        if receive is None:         
+        if receive is None:
             receive = ''
 
     # define and set address type
@@ -438,45 +467,102 @@ def main():
 
     # main logic, monitor generic
 
-    try:
-        result = {'changed': False}  # default
+    changed = False
+
+    if state == 'absent':
+        if monitor_exists:
+            if not module.check_mode:
+                # possible race condition if same task
+                # on other node deleted it first
+                changed |= delete_monitor(api, monitor)
+            else:
+                changed |= True
+
+    else: # state present
+        ## check for monitor itself
+        if not monitor_exists: # create it
+            if not module.check_mode:
+                # again, check changed status here b/c race conditions
+                # if other task already created it
+                changed |= create_monitor(api, monitor, template_attributes)
+            else:
+                changed |= True
+
+        ## check for monitor parameters
+        # whether it already existed, or was just created, now update
+        # the update functions need to check for check mode but
+        # cannot update settings if it doesn't exist which happens in check mode
+        if monitor_exists and not module.check_mode:
+            changed |= update_monitor_properties(api, module, monitor,
+                                                 template_string_properties,
+                                                 template_integer_properties)
+        # else assume nothing changed
+
+        # we just have to update the ipport if monitor already exists and it's different
+        if monitor_exists and cur_ipport != ipport:
+            set_ipport(api, monitor, ipport)
+            changed |= True
+        #else: monitor doesn't exist (check mode) or ipport is already ok
+
+    return changed
+
+
+def main():
+
+    module = AnsibleModule(
+        argument_spec = dict(
+            server    = dict(required=True),
+            user      = dict(required=True),
+            password  = dict(required=True),
+            partition = dict(default='Common'),
+            state     = dict(default='present', choices=['present', 'absent']),
+            name      = dict(required=False),
+            type      = dict(default=DEFAULT_TEMPLATE_TYPE_CHOICE, choices=TEMPLATE_TYPE_CHOICES),
+            parent    = dict(default=DEFAULT_PARENT),
+            parent_partition = dict(default='Common'),
+            send      = dict(required=False),
+            receive   = dict(required=False),
+            ip        = dict(required=False),
+            port      = dict(required=False, type='int'),
+            interval  = dict(required=False, type='int'),
+            timeout   = dict(required=False, type='int'),
+            time_until_up = dict(required=False, type='int', default=0),
+            monitors  = dict(required=False, type='list'),
+            wsdl_cache_dir = dict(required=False)
+        ),
+        mutually_exclusive = [['name', 'monitors']],
+        required_one_of = [['name', 'monitors']],
+        supports_check_mode=True
+    )
+
+    server = module.params['server']
+    user = module.params['user']
+    password = module.params['password']
+    wsdl_cache_dir = module.params['wsdl_cache_dir']
+
+    # every item of monitors overrides the module level options
+    monitors = []
+    for item in module.params['monitors'] or [{}]:
+        params = dict(module.params)
+        params.update(item)
+        if not params['name']:
+            module.fail_json(msg="each item of monitors must have a name")
+        if params['type'] not in TEMPLATE_TYPE_CHOICES:
+            module.fail_json(msg="type must be one of: %s" % ', '.join(TEMPLATE_TYPE_CHOICES))
+        for key in ('port', 'interval', 'timeout', 'time_until_up'):
+            if params[key] is not None:
+                params[key] = int(params[key])
+        monitors.append(params)
 
+    if not bigsuds_found:
+        module.fail_json(msg="the python bigsuds module is required")
+    api = bigip_api(server, user, password, wsdl_cache_dir)
 
-        if state == 'absent':
-            if monitor_exists:
-                if not module.check_mode:
-                    # possible race condition if same task 
-                    # on other node deleted it first
-                    result['changed'] |= delete_monitor(api, monitor)
-                else:
-                    result['changed'] |= True
-
-        else: # state present
-            ## check for monitor itself
-            if not monitor_exists: # create it
-                if not module.check_mode: 
-                    # again, check changed status here b/c race conditions
-                    # if other task already created it
-                    result['changed'] |= create_monitor(api, monitor, template_attributes)
-                else: 
-                    result['changed'] |= True
-
-            ## check for monitor parameters
-            # whether it already existed, or was just created, now update
-            # the update functions need to check for check mode but
-            # cannot update settings if it doesn't exist which happens in check mode
-            if monitor_exists and not module.check_mode:
-                result['changed'] |= update_monitor_properties(api, module, monitor,
-                                                               template_string_properties,
-                                                               template_integer_properties)
-            # else assume nothing changed
-
-            # we just have to update the ipport if monitor already exists and it's different
-            if monitor_exists and cur_ipport != ipport:
-                set_ipport(api, monitor, ipport)    
-                result['changed'] |= True
-            #else: monitor doesn't exist (check mode) or ipport is already ok
+    try:
+        result = {'changed': False}  # default
 
+        for params in monitors:
+            result['changed'] |= manage_monitor(module, api, params)
 
     except Exception, e:
         module.fail_json(msg="received exception: %s" % e)
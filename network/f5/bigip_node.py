@@ -70,7 +70,7 @@ options:
         aliases: []
     name:
         description:
-            - "Node name"
+            - "Node name. Required unless C(nodes) is used."
         required: false
         default: null
         choices: []
@@ -87,6 +87,41 @@ options:
         required: false
         default: null
         choices: []
+    nodes:
+        description:
+            - "List of nodes to manage in one run, instead of C(name). Each
+              item is a dictionary with a C(name) key and optionally C(host)
+              and C(description). The existing nodes of the partition, their
+              addresses and descriptions are read once, and only the
+              differences are applied with one create, delete and
+              set_description call each. The created, deleted and updated
+              nodes are returned."
+        required: false
+        default: null
+        choices: []
+        version_added: "2.0"
+    transaction:
+        description:
+            - "Queue all changes of the run in an iControl transaction and
+              commit them at once, so that a failure does not leave a partly
+              configured node. Errors of queued changes, such as deleting a
+              node that is still referenced by a pool, are reported when the
+              transaction is submitted."
+        required: false
+        default: false
+        choices: []
+        version_added: "2.0"
+    wsdl_cache_dir:
+        description:
+            - "Directory in which the parsed iControl WSDLs are cached, in one
+              subdirectory per host and software version, so that later runs do
+              not download and parse them again. Finding the software version
+              costs one extra get_version call, through a second client, on
+              each run."
+        required: false
+        default: null
+        choices: []
+        version_added: "2.0"
 '''
 
 EXAMPLES = '''
@@ -127,6 +162,21 @@ EXAMPLES = '''
       name="{{ ansible_default_ipv4["address"] }}"
       description="Our best server yet"
 
+  - name: Add all web server nodes in one task
+    local_action:
+      module: bigip_node
+      server: lb.mydomain.com
+      user: admin
+      password: mysecret
+      state: present
+      partition: matthite
+      nodes:
+        - name: web01
+          host: 10.0.0.10
+          description: "web server"
+        - name: web02
+          host: 10.0.0.11
+
   - name: Delete node
     local_action: >
       bigip_node
@@ -139,6 +189,8 @@ EXAMPLES = '''
 
 '''
 
+import os
+
 try:
     import bigsuds
 except ImportError:
@@ -150,10 +202,36 @@ else:
 # bigip_node module specific
 #
 
-def bigip_api(bigip, user, password):
-    api = bigsuds.BIGIP(hostname=bigip, username=user, password=password)
+def wsdl_cache_path(bigip, user, password, wsdl_cache_dir):
+    hostdir = os.path.join(os.path.expanduser(wsdl_cache_dir), bigip)
+    # the lookup only relies on SystemInfo.get_version existing on every
+    # release; its WSDL stays in the host directory, which suds expires after
+    # a day like the rest of its cache
+    api = bigsuds.BIGIP(hostname=bigip, username=user, password=password,
+                        cachedir=hostdir)
+    version = api.System.SystemInfo.get_version()
+    return os.path.join(hostdir, version.replace(os.sep, '_'))
+
+def bigip_api(bigip, user, password, session=False, wsdl_cache_dir=None):
+    cachedir = None
+    if wsdl_cache_dir:
+        cachedir = wsdl_cache_path(bigip, user, password, wsdl_cache_dir)
+    api = bigsuds.BIGIP(hostname=bigip, username=user, password=password,
+                        cachedir=cachedir)
+    if session:
+        # transactions are bound to an iControl session
+        api = api.with_session_id()
     return api
 
+def start_transaction(api):
+    api.System.Session.start_transaction()
+
+def submit_transaction(api):
+    api.System.Session.submit_transaction()
+
+def rollback_transaction(api):
+    api.System.Session.rollback_transaction()
+
 def node_exists(api, address):
     # hack to determine if node exists
     result = False
@@ -206,6 +284,112 @@ def set_node_description(api, name, description):
 def get_node_description(api, name):
     return api.LocalLB.NodeAddressV2.get_description(nodes=[name])[0]
 
+def get_node_list(api, partition):
+    # the folder and query state belong to the session, which is shared with
+    # the rest of the run, so they are put back once the list is read
+    session = api.System.Session
+    folder = session.get_active_folder()
+    recursive = session.get_recursive_query_state()
+    try:
+        session.set_active_folder(folder="/%s" % partition)
+        session.set_recursive_query_state(state="STATE_DISABLED")
+        return api.LocalLB.NodeAddressV2.get_list()
+    finally:
+        session.set_active_folder(folder=folder)
+        session.set_recursive_query_state(state=recursive)
+
+def create_node_addresses(api, names, addresses):
+    api.LocalLB.NodeAddressV2.create(nodes=names, addresses=addresses,
+                                     limits=[0] * len(names))
+
+def delete_node_addresses(api, names):
+    # returns the deleted nodes and the nodes still referenced by a pool
+    try:
+        api.LocalLB.NodeAddressV2.delete_node_address(nodes=names)
+        return (names, [])
+    except bigsuds.OperationFailed, e:
+        if "is referenced by a member of pool" not in str(e):
+            raise
+    # the whole call was rejected; delete the nodes one by one
+    deleted = []
+    referenced = []
+    for name in names:
+        if delete_node_address(api, name)[0]:
+            deleted.append(name)
+        else:
+            referenced.append(name)
+    return (deleted, referenced)
+
+def get_node_addresses(api, names):
+    return api.LocalLB.NodeAddressV2.get_address(nodes=names)
+
+def get_node_descriptions(api, names):
+    return api.LocalLB.NodeAddressV2.get_description(nodes=names)
+
+def set_node_descriptions(api, names, descriptions):
+    api.LocalLB.NodeAddressV2.set_description(nodes=names,
+                                              descriptions=descriptions)
+
+def reconcile_nodes(api, partition, state, nodes, check_mode):
+    existing = set(get_node_list(api, partition))
+    result = {'changed': False, 'created': [], 'deleted': [], 'updated': []}
+
+    if state == 'absent':
+        names = [x['address'] for x in nodes if x['address'] in existing]
+        if names:
+            result['changed'] = True
+            if check_mode:
+                result['deleted'] = names
+            else:
+                result['deleted'], referenced = delete_node_addresses(api, names)
+                if referenced:
+                    result['msg'] = "unable to delete, node referenced by pool: %s" % \
+                                    ', '.join(referenced)
+                    result['failed'] = True
+        return result
+
+    created = [x for x in nodes if x['address'] not in existing]
+    current = [x for x in nodes if x['address'] in existing]
+
+    missing = [x['address'] for x in created if x['host'] is None]
+    if missing:
+        result['msg'] = "host required for nodes which do not exist: %s" % \
+                        ', '.join(missing)
+        result['failed'] = True
+        return result
+
+    checked = [x for x in current if x['host'] is not None]
+    if checked:
+        addresses = get_node_addresses(api, [x['address'] for x in checked])
+        moved = [x['address'] for x, address in zip(checked, addresses)
+                 if address != x['host']]
+        if moved:
+            result['msg'] = "Changing the node address is not supported by " \
+                            "the API; delete and recreate the node: %s" % \
+                            ', '.join(moved)
+            result['failed'] = True
+            return result
+
+    changes = [x for x in created if x['description'] is not None]
+    checked = [x for x in current if x['description'] is not None]
+    if checked:
+        descriptions = get_node_descriptions(api, [x['address'] for x in checked])
+        updated = [x for x, description in zip(checked, descriptions)
+                   if description != x['description']]
+        result['updated'] = [x['address'] for x in updated]
+        changes += updated
+
+    if created:
+        result['created'] = [x['address'] for x in created]
+        if not check_mode:
+            create_node_addresses(api, [x['address'] for x in created],
+                                  [x['host'] for x in created])
+    if changes and not check_mode:
+        set_node_descriptions(api, [x['address'] for x in changes],
+                              [x['description'] for x in changes])
+    result['changed'] = bool(created or changes)
+    return result
+
 def main():
     module = AnsibleModule(
         argument_spec = dict(
@@ -214,10 +398,15 @@ def main():
             password = dict(type='str', required=True),
             state = dict(type='str', default='present', choices=['present', 'absent']),
             partition = dict(type='str', default='Common'),
-            name = dict(type='str', required=True),
+            name = dict(type='str'),
             host = dict(type='str', aliases=['address', 'ip']),
-            description = dict(type='str')
+            description = dict(type='str'),
+            nodes = dict(type='list'),
+            transaction = dict(type='bool', default=False),
+            wsdl_cache_dir = dict(type='str')
         ),
+        mutually_exclusive = [['nodes', 'name'], ['nodes', 'host']],
+        required_one_of = [['nodes', 'name']],
         supports_check_mode=True
     )
 
@@ -233,15 +422,38 @@ def main():
     name = module.params['name']
     address = "/%s/%s" % (partition, name)
     description = module.params['description']
+    nodes = module.params['nodes']
+    transaction = module.params['transaction']
+    wsdl_cache_dir = module.params['wsdl_cache_dir']
 
     if state == 'absent' and host is not None:
         module.fail_json(msg="host parameter invalid when state=absent")
 
+    if nodes:
+        for node in nodes:
+            if not isinstance(node, dict) or not node.get('name'):
+                module.fail_json(msg="each item of nodes must have a name")
+            node['host'] = node.get('host') or node.get('address') or node.get('ip')
+            node['address'] = "/%s/%s" % (partition, node['name'])
+            node.setdefault('description', None)
+            if state == 'absent' and node['host'] is not None:
+                module.fail_json(msg="host parameter invalid when state=absent")
+
+    in_transaction = False
     try:
-        api = bigip_api(server, user, password)
+        api = bigip_api(server, user, password, transaction, wsdl_cache_dir)
+        if transaction:
+            start_transaction(api)
+            in_transaction = True
         result = {'changed': False}  # default
 
-        if state == 'absent':
+        if nodes:
+            result = reconcile_nodes(api, partition, state, nodes,
+                                     module.check_mode)
+            if result.get('failed'):
+                module.fail_json(**result)
+
+        elif state == 'absent':
             if node_exists(api, address):
                 if not module.check_mode:
                     deleted, desc = delete_node_address(api, address)
@@ -283,8 +495,24 @@ def main():
                             set_node_description(api, address, description)
                         result = {'changed': True}
 
+        if transaction:
+            if result['changed'] and not module.check_mode:
+                submit_transaction(api)
+                in_transaction = False
+            else:
+                rollback_transaction(api)
+                in_transaction = False
+
     except Exception, e:
         module.fail_json(msg="received exception: %s" % e)
+    finally:
+        # failures, including fail_json calls, must not leave the
+        # transaction open on the device
+        if in_transaction:
+            try:
+                rollback_transaction(api)
+            except Exception:
+                pass
 
     module.exit_json(**result)
 
@@ -146,6 +146,53 @@ options:
         default: null
         choices: []
         aliases: []
+    members:
+        description:
+            - "List of pool members, given as C(host:port) strings or as
+              dictionaries with C(host) and C(port) keys. With C(state=present)
+              the missing members are added with a single call. With
+              C(state=absent) the listed members are removed with a single
+              call and the pool is kept. Cannot be used with C(host) and
+              C(port)."
+        version_added: "2.0"
+        required: False
+        default: null
+        choices: []
+        aliases: []
+    purge:
+        description:
+            - "When C(state=present) and C(members) is set, also remove the
+              pool members that are not listed, and delete their node
+              addresses if no other pool references them."
+        version_added: "2.0"
+        required: False
+        default: 'no'
+        choices: ['yes', 'no']
+        aliases: []
+    transaction:
+        description:
+            - "Queue all changes of the run in an iControl transaction and
+              commit them at once, so that a failure does not leave a partly
+              configured object. Errors of queued changes are reported when
+              the transaction is submitted. Unused node addresses are deleted
+              after the transaction has been committed."
+        version_added: "2.0"
+        required: False
+        default: 'no'
+        choices: ['yes', 'no']
+        aliases: []
+    wsdl_cache_dir:
+        description:
+            - "Directory in which the parsed iControl WSDLs are cached, in one
+              subdirectory per host and software version, so that later runs do
+              not download and parse them again. Finding the software version
+              costs one extra get_version call, through a second client, on
+              each run."
+        version_added: "2.0"
+        required: False
+        default: null
+        choices: []
+        aliases: []
 '''
 
 EXAMPLES = '''
@@ -208,6 +255,22 @@ EXAMPLES = '''
 
 - hosts: localhost
   tasks:
+  - name: Make the pool contain exactly these members
+    local_action:
+      module: bigip_pool
+      server: lb.mydomain.com
+      user: admin
+      password: mysecret
+      state: present
+      name: matthite-pool
+      partition: matthite
+      members:
+        - 10.0.0.10:80
+        - 10.0.0.11:80
+        - host: 10.0.0.12
+          port: 8080
+      purge: yes
+
   - name: Delete pool
     local_action: >
       bigip_pool
@@ -220,6 +283,8 @@ EXAMPLES = '''
 
 '''
 
+import os
+
 try:
     import bigsuds
 except ImportError:
@@ -231,10 +296,36 @@ else:
 # bigip_pool module specific support methods.
 #
 
-def bigip_api(bigip, user, password):
-    api = bigsuds.BIGIP(hostname=bigip, username=user, password=password)
+def wsdl_cache_path(bigip, user, password, wsdl_cache_dir):
+    hostdir = os.path.join(os.path.expanduser(wsdl_cache_dir), bigip)
+    # the lookup only relies on SystemInfo.get_version existing on every
+    # release; its WSDL stays in the host directory, which suds expires after
+    # a day like the rest of its cache
+    api = bigsuds.BIGIP(hostname=bigip, username=user, password=password,
+                        cachedir=hostdir)
+    version = api.System.SystemInfo.get_version()
+    return os.path.join(hostdir, version.replace(os.sep, '_'))
+
+def bigip_api(bigip, user, password, session=False, wsdl_cache_dir=None):
+    cachedir = None
+    if wsdl_cache_dir:
+        cachedir = wsdl_cache_path(bigip, user, password, wsdl_cache_dir)
+    api = bigsuds.BIGIP(hostname=bigip, username=user, password=password,
+                        cachedir=cachedir)
+    if session:
+        # transactions are bound to an iControl session
+        api = api.with_session_id()
     return api
 
+def start_transaction(api):
+    api.System.Session.start_transaction()
+
+def submit_transaction(api):
+    api.System.Session.submit_transaction()
+
+def rollback_transaction(api):
+    api.System.Session.rollback_transaction()
+
 def pool_exists(api, pool):
     # hack to determine if pool exists
     result = False
@@ -336,6 +427,79 @@ def add_pool_member(api, pool, address, port):
     members = [{'address': address, 'port': port}]
     api.LocalLB.Pool.add_member_v2(pool_names=[pool], members=[members])
 
+def get_pool_members(api, pool):
+    try:
+        members = api.LocalLB.Pool.get_member_v2(pool_names=[pool])[0]
+    except bigsuds.OperationFailed, e:
+        if "was not found" in str(e):
+            return []
+        raise
+    return [(x['address'], x['port']) for x in members]
+
+def add_pool_members(api, pool, keys):
+    members = [{'address': address, 'port': port} for address, port in keys]
+    api.LocalLB.Pool.add_member_v2(pool_names=[pool], members=[members])
+
+def remove_pool_members(api, pool, keys):
+    members = [{'address': address, 'port': port} for address, port in keys]
+    api.LocalLB.Pool.remove_member_v2(pool_names=[pool], members=[members])
+
+def delete_node_addresses(api, addresses):
+    try:
+        api.LocalLB.NodeAddressV2.delete_node_address(nodes=addresses)
+        return addresses
+    except bigsuds.OperationFailed, e:
+        if "is referenced by a member of pool" not in str(e):
+            raise
+    # some nodes are still in use elsewhere; delete the others one by one
+    return [x for x in addresses if delete_node_address(api, x)]
+
+def parse_members(members, partition):
+    result = []
+    for member in members:
+        if isinstance(member, dict):
+            host = member.get('host')
+            port = member.get('port')
+        else:
+            host, sep, port = str(member).rpartition(':')
+        if not host or not port:
+            raise ValueError("invalid pool member: %s" % member)
+        port = int(port)
+        if not 1 <= port <= 65535:
+            raise ValueError("valid ports must be in range 1 - 65535")
+        result.append(("/%s/%s" % (partition, host), port))
+    return result
+
+def sync_pool_members(api, pool, state, members, purge, check_mode,
+                      pending=None):
+    current = get_pool_members(api, pool)
+    result = {'changed': False}
+    if state == 'absent':
+        added = []
+        removed = [x for x in members if x in current]
+    else:
+        added = [x for x in members if x not in current]
+        removed = []
+        if purge:
+            removed = [x for x in current if x not in members]
+    if added:
+        result['added'] = ["%s:%s" % x for x in added]
+        if not check_mode:
+            add_pool_members(api, pool, added)
+    if removed:
+        result['removed'] = ["%s:%s" % x for x in removed]
+        if not check_mode:
+            remove_pool_members(api, pool, removed)
+            # only clean up nodes no longer used by this pool
+            remaining = set([x[0] for x in current + added if x not in removed])
+            orphans = list(set([x[0] for x in removed]) - remaining)
+            if pending is not None:
+                pending.extend(orphans)
+            elif orphans:
+                result['deleted'] = delete_node_addresses(api, orphans)
+    result['changed'] = bool(added or removed)
+    return result
+
 def main():
     lb_method_choices = ['round_robin', 'ratio_member',
                          'least_connection_member', 'observed_member',
@@ -369,8 +533,13 @@ def main():
             slow_ramp_time = dict(type='int'),
             service_down_action = dict(type='str', choices=service_down_choices),
             host = dict(type='str', aliases=['address']),
-            port = dict(type='int')
+            port = dict(type='int'),
+            members = dict(type='list'),
+            purge = dict(type='bool', default=False),
+            transaction = dict(type='bool', default=False),
+            wsdl_cache_dir = dict(type='str')
         ),
+        mutually_exclusive = [['members', 'host'], ['members', 'port']],
         supports_check_mode=True
     )
 
@@ -406,9 +575,21 @@ def main():
     host = module.params['host']
     address = "/%s/%s" % (partition, host)
     port = module.params['port']
+    members = module.params['members']
+    purge = module.params['purge']
+    transaction = module.params['transaction']
+    wsdl_cache_dir = module.params['wsdl_cache_dir']
 
     # sanity check user supplied values
 
+    if members is not None:
+        try:
+            members = parse_members(members, partition)
+        except ValueError, e:
+            module.fail_json(msg=str(e))
+    elif purge:
+        module.fail_json(msg="purge requires members parameter")
+
     if (host and not port) or (port and not host):
         module.fail_json(msg="both host and port must be supplied")
 
@@ -434,18 +615,36 @@ def main():
         # no monitors specified but quorum exists
         module.fail_json(msg="quorum requires monitors parameter")
 
+    # node addresses to delete once the transaction has been committed;
+    # a node still referenced elsewhere would otherwise abort the transaction
+    pending = None
+    if transaction:
+        pending = []
+
+    in_transaction = False
     try:
-        api = bigip_api(server, user, password)
+        api = bigip_api(server, user, password, transaction, wsdl_cache_dir)
+        if transaction:
+            start_transaction(api)
+            in_transaction = True
         result = {'changed': False}  # default
 
         if state == 'absent':
-            if host and port and pool:
+            if members is not None:
+                # member removal takes precedent
+                result = sync_pool_members(api, pool, state, members, purge,
+                                           module.check_mode, pending)
+            elif host and port and pool:
                 # member removal takes precedent
                 if pool_exists(api, pool) and member_exists(api, pool, address, port):
                     if not module.check_mode:
                         remove_pool_member(api, pool, address, port)
-                        deleted = delete_node_address(api, address)
-                        result = {'changed': True, 'deleted': deleted}
+                        if transaction:
+                            pending.append(address)
+                            result = {'changed': True}
+                        else:
+                            deleted = delete_node_address(api, address)
+                            result = {'changed': True, 'deleted': deleted}
                     else:
                         result = {'changed': True}
             elif pool_exists(api, pool):
@@ -525,8 +724,35 @@ def main():
                         add_pool_member(api, pool, address, port)
                     result = {'changed': True}
 
+            if members is not None:
+                changed = result['changed']
+                result = sync_pool_members(api, pool, state, members, purge,
+                                           module.check_mode, pending)
+                result['changed'] = result['changed'] or changed
+
+        if transaction:
+            if result['changed'] and not module.check_mode:
+                submit_transaction(api)
+                in_transaction = False
+                if members is not None:
+                    if pending:
+                        result['deleted'] = delete_node_addresses(api, pending)
+                elif pending:
+                    result['deleted'] = delete_node_address(api, pending[0])
+            else:
+                rollback_transaction(api)
+                in_transaction = False
+
     except Exception, e:
         module.fail_json(msg="received exception: %s" % e)
+    finally:
+        # failures, including fail_json calls, must not leave the
+        # transaction open on the device
+        if in_transaction:
+            try:
+                rollback_transaction(api)
+            except Exception:
+                pass
 
     module.exit_json(**result)
 
@@ -79,18 +79,32 @@ options:
         aliases: []
     host:
         description:
-            - Pool member IP
-        required: true
+            - Pool member IP. Required unless C(members) is used.
+        required: false
         default: null
         choices: []
         aliases: ['address', 'name']
     port:
         description:
-            - Pool member port
-        required: true
+            - Pool member port. Required unless C(members) is used.
+        required: false
+        default: null
+        choices: []
+        aliases: []
+    members:
+        description:
+            - List of pool members to manage in one run, instead of C(host)
+              and C(port). Each item is a dictionary with C(host) and C(port)
+              keys and optionally C(connection_limit), C(description),
+              C(rate_limit), C(ratio), C(session_state) and C(monitor_state).
+              The current members and their attributes are read with one call
+              per attribute, and all additions, removals and attribute changes
+              are applied with one call each.
+        required: false
         default: null
         choices: []
         aliases: []
+        version_added: "2.0"
     connection_limit:
         description:
             - Pool member connection limit. Setting this to 0 disables the limit.
@@ -119,6 +133,82 @@ options:
         default: null
         choices: []
         aliases: []
+    session_state:
+        description:
+            - Set new session availability status for pool member. A member
+              with disabled sessions keeps its current connections but gets
+              no new ones, which is what is needed to drain it. Also applies
+              to the items of C(members) that do not set it.
+        required: false
+        default: null
+        choices: ['enabled', 'disabled']
+        aliases: []
+        version_added: "2.0"
+    monitor_state:
+        description:
+            - Set monitor availability status for pool member. Disabling the
+              monitor forces the member offline. Also applies to the items of
+              C(members) that do not set it.
+        required: false
+        default: null
+        choices: ['enabled', 'disabled']
+        aliases: []
+        version_added: "2.0"
+    wait_for_drain:
+        description:
+            - Wait until the current connections of the pool member, or of
+              every item of C(members), are at or below C(drain_connections).
+              The statistics of all members are read with one call per poll,
+              so that they drain in parallel. The poll interval starts at one
+              second and doubles, up to 30 seconds, while no member loses
+              connections. Only valid with C(state=present).
+        required: false
+        default: false
+        choices: []
+        aliases: []
+        version_added: "2.0"
+    drain_connections:
+        description:
+            - Number of current connections at which a member counts as
+              drained.
+        required: false
+        default: 0
+        choices: []
+        aliases: []
+        version_added: "2.0"
+    drain_timeout:
+        description:
+            - Number of seconds to wait for the members to drain before
+              failing.
+        required: false
+        default: 300
+        choices: []
+        aliases: []
+        version_added: "2.0"
+    transaction:
+        description:
+            - Queue all changes of the run in an iControl transaction and
+              commit them at once, so that a failure does not leave a partly
+              configured member. Errors of queued changes are reported when
+              the transaction is submitted. Unused node addresses are deleted
+              after the transaction has been committed.
+        required: false
+        default: false
+        choices: []
+        aliases: []
+        version_added: "2.0"
+    wsdl_cache_dir:
+        description:
+            - Directory in which the parsed iControl WSDLs are cached, in one
+              subdirectory per host and software version, so that later runs do
+              not download and parse them again. Finding the software version
+              costs one extra get_version call, through a second client, on
+              each run.
+        required: false
+        default: null
+        choices: []
+        aliases: []
+        version_added: "2.0"
 '''
 
 EXAMPLES = '''
@@ -172,8 +262,46 @@ EXAMPLES = '''
       host="{{ ansible_default_ipv4["address"] }}"
       port=80
 
+  - name: Add all web servers to the pool in one task
+    local_action:
+      module: bigip_pool_member
+      server: lb.mydomain.com
+      user: admin
+      password: mysecret
+      state: present
+      pool: matthite-pool
+      partition: matthite
+      members:
+        - host: 10.0.0.10
+          port: 80
+          ratio: 2
+        - host: 10.0.0.11
+          port: 80
+          description: "nginx server"
+
+  - name: Disable web servers and wait for their connections to drain
+    local_action:
+      module: bigip_pool_member
+      server: lb.mydomain.com
+      user: admin
+      password: mysecret
+      state: present
+      pool: matthite-pool
+      partition: matthite
+      session_state: disabled
+      wait_for_drain: yes
+      drain_timeout: 600
+      members:
+        - host: 10.0.0.10
+          port: 80
+        - host: 10.0.0.11
+          port: 80
+
 '''
 
+import os
+import time
+
 try:
     import bigsuds
 except ImportError:
@@ -181,14 +309,44 @@ except ImportError:
 else:
     bigsuds_found = True
 
+# seconds between two statistics polls while waiting for members to drain
+DRAIN_POLL_MIN = 1
+DRAIN_POLL_MAX = 30
+
 # ===========================================
 # bigip_pool_member module specific support methods.
 #
 
-def bigip_api(bigip, user, password):
-    api = bigsuds.BIGIP(hostname=bigip, username=user, password=password)
+def wsdl_cache_path(bigip, user, password, wsdl_cache_dir):
+    hostdir = os.path.join(os.path.expanduser(wsdl_cache_dir), bigip)
+    # the lookup only relies on SystemInfo.get_version existing on every
+    # release; its WSDL stays in the host directory, which suds expires after
+    # a day like the rest of its cache
+    api = bigsuds.BIGIP(hostname=bigip, username=user, password=password,
+                        cachedir=hostdir)
+    version = api.System.SystemInfo.get_version()
+    return os.path.join(hostdir, version.replace(os.sep, '_'))
+
+def bigip_api(bigip, user, password, session=False, wsdl_cache_dir=None):
+    cachedir = None
+    if wsdl_cache_dir:
+        cachedir = wsdl_cache_path(bigip, user, password, wsdl_cache_dir)
+    api = bigsuds.BIGIP(hostname=bigip, username=user, password=password,
+                        cachedir=cachedir)
+    if session:
+        # transactions are bound to an iControl session
+        api = api.with_session_id()
     return api
 
+def start_transaction(api):
+    api.System.Session.start_transaction()
+
+def submit_transaction(api):
+    api.System.Session.submit_transaction()
+
+def rollback_transaction(api):
+    api.System.Session.rollback_transaction()
+
 def pool_exists(api, pool):
     # hack to determine if pool exists
     result = False
@@ -276,6 +434,189 @@ def set_ratio(api, pool, address, port, ratio):
     members = [{'address': address, 'port': port}]
     api.LocalLB.Pool.set_member_ratio(pool_names=[pool], members=[members], ratios=[[ratio]])
 
+# member attribute name, iControl getter, iControl setter, setter value argument
+MEMBER_ATTRIBUTES = (
+    ('connection_limit', 'get_member_connection_limit',
+     'set_member_connection_limit', 'limits'),
+    ('description', 'get_member_description',
+     'set_member_description', 'descriptions'),
+    ('rate_limit', 'get_member_rate_limit',
+     'set_member_rate_limit', 'limits'),
+    ('ratio', 'get_member_ratio', 'set_member_ratio', 'ratios'),
+)
+
+def get_pool_members(api, pool):
+    try:
+        members = api.LocalLB.Pool.get_member_v2(pool_names=[pool])[0]
+    except bigsuds.OperationFailed, e:
+        if "was not found" in str(e):
+            return None
+        raise
+    return [(x['address'], x['port']) for x in members]
+
+def to_members(keys):
+    return [{'address': address, 'port': port} for address, port in keys]
+
+def add_pool_members(api, pool, keys):
+    api.LocalLB.Pool.add_member_v2(pool_names=[pool], members=[to_members(keys)])
+
+def remove_pool_members(api, pool, keys):
+    api.LocalLB.Pool.remove_member_v2(pool_names=[pool], members=[to_members(keys)])
+
+def get_members_attribute(api, pool, keys, getter):
+    return getattr(api.LocalLB.Pool, getter)(pool_names=[pool],
+                                             members=[to_members(keys)])[0]
+
+def set_members_attribute(api, pool, keys, setter, argument, values):
+    kwargs = {'pool_names': [pool], 'members': [to_members(keys)],
+              argument: [values]}
+    getattr(api.LocalLB.Pool, setter)(**kwargs)
+
+def delete_node_addresses(api, addresses):
+    try:
+        api.LocalLB.NodeAddressV2.delete_node_address(nodes=addresses)
+        return addresses
+    except bigsuds.OperationFailed, e:
+        if "is referenced by a member of pool" not in str(e):
+            raise
+    # some nodes are still in use elsewhere; delete the others one by one
+    return [x for x in addresses if delete_node_address(api, x)]
+
+def get_members_session_state(api, pool, keys):
+    states = get_members_attribute(api, pool, keys,
+                                   'get_member_session_enabled_state')
+    return [x.split("STATE_")[-1].lower() for x in states]
+
+def get_members_monitor_state(api, pool, keys):
+    # there is no getter for the monitor state, but a member whose
+    # monitor is disabled is forced down
+    status = get_members_attribute(api, pool, keys, 'get_member_monitor_status')
+    return [x == 'MONITOR_STATUS_FORCED_DOWN' and 'disabled' or 'enabled'
+            for x in status]
+
+# member state name, getter, iControl setter, setter value argument
+MEMBER_STATES = (
+    ('session_state', get_members_session_state,
+     'set_member_session_enabled_state', 'session_states'),
+    ('monitor_state', get_members_monitor_state,
+     'set_member_monitor_state', 'monitor_states'),
+)
+
+def update_member_states(api, pool, wanted, check_mode, added=()):
+    # wanted is a list of (member key, dict with the wanted states); states
+    # of just added members are set without reading them first
+    updated = set()
+    for name, getter, setter, argument in MEMBER_STATES:
+        states = [(key, member[name]) for key, member in wanted
+                  if member.get(name) is not None]
+        if not states:
+            continue
+        changes = [x for x in states if x[0] in added]
+        existing = [x for x in states if x[0] not in added]
+        if existing:
+            values = getter(api, pool, [x[0] for x in existing])
+            differing = [x for x, value in zip(existing, values) if x[1] != value]
+            changes += differing
+            updated.update([x[0] for x in differing])
+        if changes and not check_mode:
+            set_members_attribute(api, pool, [x[0] for x in changes],
+                                  setter, argument,
+                                  ["STATE_%s" % x[1].upper() for x in changes])
+    return updated
+
+def get_members_connections(api, pool, keys):
+    stats = api.LocalLB.Pool.get_member_statistics(pool_names=[pool],
+                                                   members=[to_members(keys)])[0]
+    result = []
+    for entry in stats['statistics']:
+        connections = 0
+        for stat in entry['statistics']:
+            if stat['type'] == 'STATISTIC_SERVER_SIDE_CURRENT_CONNECTIONS':
+                connections = (stat['value']['high'] << 32) | stat['value']['low']
+                break
+        result.append(connections)
+    return result
+
+def wait_for_members_drain(api, pool, keys, threshold, timeout):
+    # returns the members which did not drain in time with their connections
+    deadline = time.time() + timeout
+    delay = DRAIN_POLL_MIN
+    last = {}
+    while True:
+        connections = get_members_connections(api, pool, keys)
+        remaining = [(key, count) for key, count in zip(keys, connections)
+                     if count > threshold]
+        if not remaining or time.time() >= deadline:
+            return remaining
+        # poll often while connections go away, back off while they do not
+        if last and not [x for x in remaining if x[1] < last[x[0]]]:
+            delay = min(delay * 2, DRAIN_POLL_MAX)
+        else:
+            delay = DRAIN_POLL_MIN
+        last = dict(remaining)
+        keys = [x[0] for x in remaining]
+        time.sleep(max(min(delay, deadline - time.time()), 0))
+
+def member_name(key):
+    return "%s:%s" % key
+
+def reconcile_members(api, pool, state, members, check_mode, pending=None):
+    current = get_pool_members(api, pool)
+    if current is None:
+        raise Exception("pool %s does not exist" % pool)
+    current = set(current)
+    keys = [(x['address'], x['port']) for x in members]
+    result = {'changed': False, 'added': [], 'removed': [], 'updated': []}
+
+    if state == 'absent':
+        removed = [x for x in keys if x in current]
+        if removed:
+            result['changed'] = True
+            result['removed'] = [member_name(x) for x in removed]
+            if not check_mode:
+                remove_pool_members(api, pool, removed)
+                addresses = list(set([x[0] for x in removed]))
+                if pending is not None:
+                    pending.extend(addresses)
+                else:
+                    result['deleted'] = delete_node_addresses(api, addresses)
+        return result
+
+    added = [x for x in keys if x not in current]
+    if added:
+        result['changed'] = True
+        result['added'] = [member_name(x) for x in added]
+        if not check_mode:
+            add_pool_members(api, pool, added)
+
+    updated = set()
+    for name, getter, setter, argument in MEMBER_ATTRIBUTES:
+        wanted = [(key, member[name]) for key, member in zip(keys, members)
+                  if member.get(name) is not None]
+        if not wanted:
+            continue
+        changes = [x for x in wanted if x[0] in added]
+        existing = [x for x in wanted if x[0] not in added]
+        if existing:
+            values = get_members_attribute(api, pool,
+                                           [x[0] for x in existing], getter)
+            differing = [x for x, value in zip(existing, values) if x[1] != value]
+            changes += differing
+            updated.update([x[0] for x in differing])
+        if changes:
+            result['changed'] = True
+            if not check_mode:
+                set_members_attribute(api, pool, [x[0] for x in changes],
+                                      setter, argument,
+                                      [x[1] for x in changes])
+    states = update_member_states(api, pool, zip(keys, members), check_mode,
+                                  added)
+    if states:
+        result['changed'] = True
+    updated.update(states)
+    result['updated'] = [member_name(x) for x in keys if x in updated]
+    return result
+
 def main():
     module = AnsibleModule(
         argument_spec = dict(
@@ -285,13 +626,23 @@ def main():
             state = dict(type='str', default='present', choices=['present', 'absent']),
             pool = dict(type='str', required=True),
             partition = dict(type='str', default='Common'),
-            host = dict(type='str', required=True, aliases=['address', 'name']),
-            port = dict(type='int', required=True),
+            host = dict(type='str', aliases=['address', 'name']),
+            port = dict(type='int'),
+            members = dict(type='list'),
             connection_limit = dict(type='int'),
             description = dict(type='str'),
             rate_limit = dict(type='int'),
-            ratio = dict(type='int')
+            ratio = dict(type='int'),
+            session_state = dict(type='str', choices=['enabled', 'disabled']),
+            monitor_state = dict(type='str', choices=['enabled', 'disabled']),
+            wait_for_drain = dict(type='bool', default=False),
+            drain_connections = dict(type='int', default=0),
+            drain_timeout = dict(type='int', default=300),
+            transaction = dict(type='bool', default=False),
+            wsdl_cache_dir = dict(type='str')
         ),
+        mutually_exclusive = [['members', 'host'], ['members', 'port']],
+        required_one_of = [['members', 'host']],
         supports_check_mode=True
     )
 
@@ -308,30 +659,79 @@ def main():
     description = module.params['description']
     rate_limit = module.params['rate_limit']
     ratio = module.params['ratio']
+    session_state = module.params['session_state']
+    monitor_state = module.params['monitor_state']
+    wait_for_drain = module.params['wait_for_drain']
+    drain_connections = module.params['drain_connections']
+    drain_timeout = module.params['drain_timeout']
     host = module.params['host']
     address = "/%s/%s" % (partition, host)
     port = module.params['port']
+    members = module.params['members']
+    transaction = module.params['transaction']
+    wsdl_cache_dir = module.params['wsdl_cache_dir']
 
     # sanity check user supplied values
 
-    if (host and not port) or (port and not host):
-        module.fail_json(msg="both host and port must be supplied")
-
-    if 1 > port > 65535:
-        module.fail_json(msg="valid ports must be in range 1 - 65535")
-
+    if members:
+        for member in members:
+            if not isinstance(member, dict) or \
+               not member.get('host') or not member.get('port'):
+                module.fail_json(msg="each item of members must have host and port")
+            member['address'] = "/%s/%s" % (partition, member['host'])
+            member['port'] = int(member['port'])
+            for name in ('connection_limit', 'rate_limit', 'ratio'):
+                if member.get(name) is not None:
+                    member[name] = int(member[name])
+            member.setdefault('session_state', session_state)
+            member.setdefault('monitor_state', monitor_state)
+            for name in ('session_state', 'monitor_state'):
+                if member[name] not in (None, 'enabled', 'disabled'):
+                    module.fail_json(msg="%s must be enabled or disabled" % name)
+            if not 1 <= member['port'] <= 65535:
+                module.fail_json(msg="valid ports must be in range 1 - 65535")
+    else:
+        if (host and not port) or (port and not host):
+            module.fail_json(msg="both host and port must be supplied")
+
+        if 1 > port > 65535:
+            module.fail_json(msg="valid ports must be in range 1 - 65535")
+
+    if wait_for_drain and state != 'present':
+        module.fail_json(msg="wait_for_drain requires state=present")
+
+    states = {'session_state': session_state, 'monitor_state': monitor_state}
+
+    # node addresses to delete once the transaction has been committed;
+    # a node still referenced elsewhere would otherwise abort the transaction
+    pending = None
+    if transaction:
+        pending = []
+
+    in_transaction = False
     try:
-        api = bigip_api(server, user, password)
-        if not pool_exists(api, pool):
+        api = bigip_api(server, user, password, transaction, wsdl_cache_dir)
+        if transaction:
+            start_transaction(api)
+            in_transaction = True
+        if not members and not pool_exists(api, pool):
             module.fail_json(msg="pool %s does not exist" % pool)
         result = {'changed': False}  # default
 
-        if state == 'absent':
+        if members:
+            result = reconcile_members(api, pool, state, members,
+                                       module.check_mode, pending)
+
+        elif state == 'absent':
             if member_exists(api, pool, address, port):
                 if not module.check_mode:
                     remove_pool_member(api, pool, address, port)
-                    deleted = delete_node_address(api, address)
-                    result = {'changed': True, 'deleted': deleted}
+                    if transaction:
+                        pending.append(address)
+                        result = {'changed': True}
+                    else:
+                        deleted = delete_node_address(api, address)
+                        result = {'changed': True, 'deleted': deleted}
                 else:
                     result = {'changed': True}
 
@@ -347,6 +747,8 @@ def main():
                         set_rate_limit(api, pool, address, port, rate_limit)
                     if ratio is not None:
                         set_ratio(api, pool, address, port, ratio)
+                    update_member_states(api, pool, [((address, port), states)],
+                                         False, [(address, port)])
                 result = {'changed': True}
             else:
                 # pool member exists -- potentially modify attributes
@@ -366,9 +768,48 @@ def main():
                     if not module.check_mode:
                         set_ratio(api, pool, address, port, ratio)
                     result = {'changed': True}
+                if update_member_states(api, pool, [((address, port), states)],
+                                        module.check_mode):
+                    result = {'changed': True}
+
+        if transaction:
+            if result['changed'] and not module.check_mode:
+                submit_transaction(api)
+                in_transaction = False
+                if members:
+                    if pending:
+                        result['deleted'] = delete_node_addresses(api, pending)
+                elif pending:
+                    result['deleted'] = delete_node_address(api, pending[0])
+            else:
+                rollback_transaction(api)
+                in_transaction = False
+
+        # wait after the transaction has been committed, the members only
+        # start draining once their new state is in effect
+        if wait_for_drain and not module.check_mode:
+            if members:
+                keys = [(x['address'], x['port']) for x in members]
+            else:
+                keys = [(address, port)]
+            remaining = wait_for_members_drain(api, pool, keys,
+                                               drain_connections, drain_timeout)
+            if remaining:
+                module.fail_json(msg="timed out waiting for pool members to drain: %s" %
+                                 ', '.join(["%s (%d connections)" % (member_name(x[0]), x[1])
+                                            for x in remaining]))
+            result['drained'] = [member_name(x) for x in keys]
 
     except Exception, e:
         module.fail_json(msg="received exception: %s" % e)
+    finally:
+        # failures, including fail_json calls, must not leave the
+        # transaction open on the device
+        if in_transaction:
+            try:
+                rollback_transaction(api)
+            except Exception:
+                pass
 
     module.exit_json(**result)
 
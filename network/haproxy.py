@@ -38,24 +38,36 @@ notes:
 options:
   state:
     description:
-      - describe the desired state of the given host in lb pool.
+      - describe the desired state of the given host in lb pool. C(facts)
+        changes nothing and returns the 'show stat' rows as the
+        C(haproxy_stats) fact, keyed by proxy name and server name, with
+        numeric fields as integers. With several sockets the facts of each
+        are returned in C(haproxy_sockets), keyed by socket path.
     required: true
     default: null
-    choices: [ "enabled", "disabled" ]
+    choices: [ "enabled", "disabled", "facts" ]
   host:
     description:
-      - Host (backend) to operate in Haproxy.
-    required: true
+      - Host (backend) to operate in Haproxy, or a list of hosts. All commands
+        for all hosts are sent over one connection to the socket. Required
+        unless C(state=facts).
+    required: false
     default: null
+    aliases: ['hosts']
   socket:
     description:
-      - Haproxy socket file name with path.
+      - Haproxy socket file name with path. May also be a list of socket
+        files or of glob patterns, e.g. the stats sockets of all processes of
+        an C(nbproc) setup. The commands are sent to all sockets concurrently
+        and the result of each is returned in C(sockets).
     required: false
     default: /var/run/haproxy.sock
   backend:
     description:
       - Name of the haproxy backend pool.
-        Required, else auto-detection applied.
+        Required, else auto-detection applied. Auto-detection parses
+        'show stat' once and only operates the backends which contain the
+        host; hosts found in no backend are returned in C(missing_hosts).
     required: false
     default: auto-detected
   weight:
@@ -68,6 +80,50 @@ options:
       - When disabling server, immediately terminate all the sessions attached to the specified server. This can be used to terminate long-running sessions after a server is put into maintenance mode, for instance.
     required: false
     default: false
+  wait:
+    description:
+      - Wait until the servers reached the new state. For C(state=disabled)
+        this is until their current sessions (scur) dropped to zero, for
+        C(state=enabled) until their status is UP. All servers in all their
+        backends are checked with one 'show stat' per poll, and the poll
+        interval doubles from half a second up to 8 seconds.
+    required: false
+    default: false
+    version_added: "2.0"
+  wait_timeout:
+    description:
+      - Number of seconds to wait before failing when C(wait) is set.
+    required: false
+    default: 300
+    version_added: "2.0"
+  timeout:
+    description:
+      - Number of seconds to wait for haproxy to answer a command on the
+        socket before failing.
+    required: false
+    default: 30
+    version_added: "2.0"
+  proxy:
+    description:
+      - With C(state=facts), only return the rows of these proxies (pxname).
+    required: false
+    default: null
+    version_added: "2.0"
+  proxy_type:
+    description:
+      - With C(state=facts), only return the rows of these types. The filter
+        is applied by haproxy, which then only sends the matching rows.
+    required: false
+    default: null
+    choices: [ "frontend", "backend", "server" ]
+    version_added: "2.0"
+  show_info:
+    description:
+      - With C(state=facts), also return the output of 'show info' as the
+        C(haproxy_info) fact.
+    required: false
+    default: false
+    version_added: "2.0"
 '''
 
 EXAMPLES = '''
@@ -91,15 +147,39 @@ examples:
 # enable server in 'www' backend pool with change server(s) weight
 - haproxy: state=enabled host={{ inventory_hostname }} socket=/var/run/haproxy.sock weight=10 backend=www
 
+# disable server in 'www' backend pool and wait for its sessions to drain
+- haproxy: state=disabled host={{ inventory_hostname }} backend=www wait=yes wait_timeout=600
+
+# disable server in all processes of an nbproc haproxy, one stats socket each
+- haproxy: state=disabled host={{ inventory_hostname }} socket=/var/run/haproxy-*.sock backend=www
+
+# gather the stats of the servers of the 'www' backend as facts
+- haproxy: state=facts proxy=www proxy_type=server show_info=yes
+
+# disable a batch of servers in one run
+- haproxy: state=disabled hosts={{ groups['batch1'] | join(',') }} backend=www
+
 author: Ravi Bhure <ravibhure@gmail.com>
 '''
 
+import glob
 import socket
+import threading
+import time
 
 
 DEFAULT_SOCKET_LOCATION="/var/run/haproxy.sock"
-RECV_SIZE = 1024
-ACTION_CHOICES = ['enabled', 'disabled']
+RECV_SIZE = 65536
+ACTION_CHOICES = ['enabled', 'disabled', 'facts']
+# bits of the <type> argument of 'show stat'
+PROXY_TYPES = {'frontend': 1, 'backend': 2, 'server': 4}
+# in interactive mode every reply is terminated by this prompt
+PROMPT = '\n> '
+# bytes of commands sent before their replies are read back
+PIPELINE_SIZE = 4096
+# seconds between two 'show stat' polls while waiting for servers
+WAIT_POLL_MIN = 0.5
+WAIT_POLL_MAX = 8
 
 ######################################################################
 class TimeoutException(Exception):
@@ -117,113 +197,338 @@ class HAProxy(object):
     http://haproxy.1wt.eu/download/1.5/doc/configuration.txt#Unix Socket commands
     """
 
-    def __init__(self, module):
+    def __init__(self, module, socket):
         self.module = module
 
         self.state = self.module.params['state']
-        self.host = self.module.params['host']
+        self.hosts = self.module.params['host']
         self.backend = self.module.params['backend']
         self.weight = self.module.params['weight']
-        self.socket = self.module.params['socket']
+        self.socket = socket
         self.shutdown_sessions = self.module.params['shutdown_sessions']
+        self.wait = self.module.params['wait']
+        self.wait_timeout = self.module.params['wait_timeout']
+        self.timeout = self.module.params['timeout']
 
+        self.client = None
         self.command_results = []
+        self.server_index = None
+        self.missing_hosts = []
 
-    def execute(self, cmd, timeout=200):
+    def connect(self):
         """
-        Executes a HAProxy command by sending a message to a HAProxy's local
-        UNIX socket and waiting up to 'timeout' milliseconds for the response.
+        Opens the connection to HAProxy's local UNIX socket and switches it
+        to interactive mode, so that it stays open for all commands.
         """
-
         self.client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # a stuck haproxy must not hang the whole play
+        self.client.settimeout(self.timeout)
         self.client.connect(self.socket)
-        self.client.sendall('%s\n' % cmd)
-        result = ''
-        buf = ''
-        buf = self.client.recv(RECV_SIZE)
-        while buf:
-            result += buf
+        # the first prompt may come without its leading newline
+        self.buffer = bytearray('\n')
+        self.client.sendall('prompt\n')
+        self.read_reply()
+
+    def close(self):
+        if self.client is not None:
+            try:
+                self.client.sendall('quit\n')
+            except socket.error:
+                pass
+            self.client.close()
+            self.client = None
+
+    def read_reply(self):
+        """
+        Reads the reply of one command, up to the next prompt.
+        """
+        start = 0
+        while True:
+            end = self.buffer.find(PROMPT, start)
+            if end >= 0:
+                reply = str(self.buffer[:end])
+                del self.buffer[:end + len(PROMPT)]
+                return reply
+            start = max(len(self.buffer) - len(PROMPT) + 1, 0)
             buf = self.client.recv(RECV_SIZE)
-        self.command_results = result.strip()
-        self.client.close()
-        return result
+            if not buf:
+                raise Exception("haproxy closed the connection on %s" % self.socket)
+            self.buffer.extend(buf)
+
+    def iter_reply_lines(self):
+        """
+        Yields the lines of the reply of one command as they arrive, so that
+        long replies are never held in memory as a whole. The reply must be
+        read to its end before the next command.
+        """
+        pos = 0
+        while True:
+            end = self.buffer.find('\n', pos)
+            # the newline may be the start of the prompt, which needs the
+            # following bytes to be told apart
+            if end >= 0 and len(self.buffer) >= end + len(PROMPT):
+                line = str(self.buffer[pos:end])
+                if self.buffer[end:end + len(PROMPT)] == PROMPT:
+                    del self.buffer[:end + len(PROMPT)]
+                    yield line
+                    return
+                yield line
+                pos = end + 1
+                continue
+            del self.buffer[:pos]
+            pos = 0
+            buf = self.client.recv(RECV_SIZE)
+            if not buf:
+                raise Exception("haproxy closed the connection on %s" % self.socket)
+            self.buffer.extend(buf)
 
-    def enabled(self, host, backend, weight):
+    def execute_batch(self, cmds):
+        """
+        Executes HAProxy commands over the open connection. The commands are
+        pipelined, and the replies are read back once a few kilobytes of
+        commands have been sent.
+        """
+        if self.client is None:
+            self.connect()
+        results = []
+        pending = 0
+        sent = 0
+        for cmd in cmds:
+            self.client.sendall('%s\n' % cmd)
+            pending += 1
+            sent += len(cmd) + 1
+            if sent >= PIPELINE_SIZE:
+                while pending:
+                    results.append(self.read_reply())
+                    pending -= 1
+                sent = 0
+        while pending:
+            results.append(self.read_reply())
+            pending -= 1
+        return results
+
+    def record(self, results):
+        self.command_results.extend([x.strip() for x in results if x.strip()])
+
+    def iter_stat(self, cmd='show stat'):
+        """
+        Runs 'show stat' and yields its rows as dictionaries keyed by the
+        names of the CSV header, parsing them while they are received.
+        """
+        if self.client is None:
+            self.connect()
+        self.client.sendall('%s\n' % cmd)
+        fields = None
+        for line in self.iter_reply_lines():
+            if fields is None:
+                #sanitize the header
+                fields = line.lstrip('# ').split(',')
+            elif line:
+                yield dict(zip(fields, line.split(',')))
+
+    def show_stat(self):
+        """
+        Runs 'show stat' and returns its rows.
+        """
+        return list(self.iter_stat())
+
+    def get_facts(self, proxies, proxy_types, show_info):
+        """
+        Returns the 'show stat' rows of the given proxies and types keyed by
+        proxy and server name, and optionally the 'show info' values.
+        """
+        cmd = 'show stat'
+        if proxy_types:
+            cmd += ' -1 %d -1' % sum([PROXY_TYPES[x] for x in set(proxy_types)])
+
+        stats = {}
+        for row in self.iter_stat(cmd):
+            if proxies and row['pxname'] not in proxies:
+                continue
+            stats.setdefault(row['pxname'], {})[row['svname']] = \
+                dict([(k, typed_value(v)) for k, v in row.items() if k])
+        facts = {'haproxy_stats': stats}
+
+        if show_info:
+            info = {}
+            self.client.sendall('show info\n')
+            for line in self.iter_reply_lines():
+                if ':' in line:
+                    key, value = line.split(':', 1)
+                    info[key.strip()] = typed_value(value.strip())
+            facts['haproxy_info'] = info
+        return facts
+
+    def get_server_index(self):
+        """
+        Returns the backends (pxname) of every server (svname), parsed from
+        'show stat' once per run.
+        """
+        if self.server_index is None:
+            self.server_index = {}
+            for row in self.show_stat():
+                if row['svname'] not in ('FRONTEND', 'BACKEND'):
+                    self.server_index.setdefault(row['svname'], []).append(row['pxname'])
+        return self.server_index
+
+    def get_backends(self, host, backend):
+        """
+        Lists the backends to operate the host in: the given one, else
+        those which contain the host.
+        """
+        if backend is not None:
+            return [backend]
+        backends = self.get_server_index().get(host, [])
+        if not backends:
+            self.missing_hosts.append(host)
+        return backends
+
+    def enabled(self, hosts, backend, weight):
         """
         Enabled action, marks server to UP and checks are re-enabled,
         also supports to get current weight for server (default) and
         set the weight for haproxy backend server when provides.
         """
-        svname = host
-        if self.backend is None:
-            output = self.execute('show stat')
-            #sanitize and make a list of lines
-            output = output.lstrip('# ').strip()
-            output = output.split('\n')
-            result = output
-
-            for line in result:
-                if 'BACKEND' in line:
-                    result =  line.split(',')[0]
-                    pxname = result
-                    cmd = "get weight %s/%s ; enable server %s/%s" % (pxname, svname, pxname, svname)
-                    if weight:
-                        cmd += "; set weight %s/%s %s" % (pxname, svname, weight)
-                    self.execute(cmd)
-
-        else:
-            pxname = backend
-            cmd = "get weight %s/%s ; enable server %s/%s" % (pxname, svname, pxname, svname)
-            if weight:
-                cmd += "; set weight %s/%s %s" % (pxname, svname, weight)
-            self.execute(cmd)
-
-    def disabled(self, host, backend, shutdown_sessions):
+        cmds = []
+        targets = []
+        for svname in hosts:
+            for pxname in self.get_backends(svname, backend):
+                targets.append((pxname, svname))
+                cmds.append("get weight %s/%s" % (pxname, svname))
+                cmds.append("enable server %s/%s" % (pxname, svname))
+                if weight:
+                    cmds.append("set weight %s/%s %s" % (pxname, svname, weight))
+        self.record(self.execute_batch(cmds))
+        return targets
+
+    def disabled(self, hosts, backend, shutdown_sessions):
         """
         Disabled action, marks server to DOWN for maintenance. In this mode, no more checks will be
         performed on the server until it leaves maintenance,
         also it shutdown sessions while disabling backend host server.
         """
-        svname = host
-        if self.backend is None:
-            output = self.execute('show stat')
-            #sanitize and make a list of lines
-            output = output.lstrip('# ').strip()
-            output = output.split('\n')
-            result = output
-
-            for line in result:
-                if 'BACKEND' in line:
-                    result =  line.split(',')[0]
-                    pxname = result
-                    cmd = "get weight %s/%s ; disable server %s/%s" % (pxname, svname, pxname, svname)
-                    if shutdown_sessions:
-                        cmd += "; shutdown sessions server %s/%s" % (pxname, svname)
-                    self.execute(cmd)
-
-        else:
-            pxname = backend
-            cmd = "get weight %s/%s ; disable server %s/%s" % (pxname, svname, pxname, svname)
-            if shutdown_sessions:
-                cmd += "; shutdown sessions server %s/%s" % (pxname, svname)
-            self.execute(cmd)
+        cmds = []
+        targets = []
+        for svname in hosts:
+            for pxname in self.get_backends(svname, backend):
+                targets.append((pxname, svname))
+                cmds.append("get weight %s/%s" % (pxname, svname))
+                cmds.append("disable server %s/%s" % (pxname, svname))
+                if shutdown_sessions:
+                    cmds.append("shutdown sessions server %s/%s" % (pxname, svname))
+        self.record(self.execute_batch(cmds))
+        return targets
+
+    def wait_for(self, targets, done):
+        """
+        Polls 'show stat' until done(row) is true for every (pxname, svname)
+        in targets, backing off exponentially between polls. Returns the
+        targets which did not get there before the timeout.
+        """
+        deadline = time.time() + self.wait_timeout
+        delay = WAIT_POLL_MIN
+        remaining = None
+        while True:
+            rows = dict(((row['pxname'], row['svname']), row) for row in self.show_stat())
+            if remaining is None:
+                # an explicit backend may not contain the server at all
+                remaining = [x for x in targets if x in rows]
+            remaining = [x for x in remaining if not done(rows[x])]
+            if not remaining or time.time() >= deadline:
+                return remaining
+            time.sleep(max(min(delay, deadline - time.time()), 0))
+            delay = min(delay * 2, WAIT_POLL_MAX)
 
     def act(self):
         """
         Figure out what you want to do from ansible, and then do it.
+        Returns the result for this socket.
         """
 
-        # toggle enable/disbale server
-        if self.state == 'enabled':
-            self.enabled(self.host, self.backend, self.weight)
-
-        elif self.state == 'disabled':
-            self.disabled(self.host, self.backend, self.shutdown_sessions)
-
-        else:
-            self.module.fail_json(msg="unknown state specified: '%s'" % self.state)
+        targets = []
+        remaining = []
+        facts = None
+        try:
+            # toggle enable/disbale server
+            if self.state == 'enabled':
+                targets = self.enabled(self.hosts, self.backend, self.weight)
+                if self.wait:
+                    remaining = self.wait_for(targets, lambda row:
+                        row['status'].startswith('UP') or row['status'] == 'no check')
+
+            elif self.state == 'disabled':
+                targets = self.disabled(self.hosts, self.backend, self.shutdown_sessions)
+                if self.wait:
+                    remaining = self.wait_for(targets, lambda row:
+                        int(row['scur'] or 0) == 0)
+
+            elif self.state == 'facts':
+                facts = self.get_facts(self.module.params['proxy'],
+                                       self.module.params['proxy_type'],
+                                       self.module.params['show_info'])
+
+            else:
+                raise Exception("unknown state specified: '%s'" % self.state)
+        finally:
+            self.close()
+
+        result = dict(stdout='\n'.join(self.command_results),
+                      missing_hosts=self.missing_hosts, changed=bool(targets),
+                      timed_out=['%s/%s' % x for x in remaining])
+        if facts is not None:
+            result['facts'] = facts
+        return result
 
-        self.module.exit_json(stdout=self.command_results, changed=True)
+def typed_value(value):
+    """
+    Converts the numeric values of the stats to integers, and empty ones
+    to None.
+    """
+    if value == '':
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+def expand_sockets(patterns):
+    """
+    Expands the glob patterns among the socket paths.
+    """
+    sockets = []
+    for pattern in patterns:
+        paths = sorted(glob.glob(pattern))
+        if not paths and not glob.has_magic(pattern):
+            # let the connection report the missing socket
+            paths = [pattern]
+        for path in paths:
+            if path not in sockets:
+                sockets.append(path)
+    return sockets
+
+def act_on_sockets(module, sockets):
+    """
+    Runs the same commands on every socket concurrently, one thread per
+    socket, and returns the result of each.
+    """
+    results = {}
+
+    def worker(path):
+        try:
+            results[path] = HAProxy(module, path).act()
+        except socket.timeout:
+            results[path] = dict(failed=True,
+                                 msg="haproxy did not answer within %d seconds" %
+                                     module.params['timeout'])
+        except Exception, e:
+            results[path] = dict(failed=True, msg=str(e))
+
+    threads = [threading.Thread(target=worker, args=(path,)) for path in sockets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
 
 def main():
 
@@ -231,20 +536,64 @@ def main():
     module = AnsibleModule(
         argument_spec = dict(
             state = dict(required=True, default=None, choices=ACTION_CHOICES),
-            host=dict(required=True, default=None),
+            host=dict(required=False, default=None, type='list', aliases=['hosts']),
             backend=dict(required=False, default=None),
             weight=dict(required=False, default=None),
-            socket = dict(required=False, default=DEFAULT_SOCKET_LOCATION),
+            socket = dict(required=False, default=DEFAULT_SOCKET_LOCATION, type='list'),
             shutdown_sessions=dict(required=False, default=False),
+            wait=dict(required=False, default=False, type='bool'),
+            wait_timeout=dict(required=False, default=300, type='int'),
+            timeout=dict(required=False, default=30, type='int'),
+            proxy=dict(required=False, default=None, type='list'),
+            proxy_type=dict(required=False, default=None, type='list'),
+            show_info=dict(required=False, default=False, type='bool'),
         ),
 
     )
 
-    if not socket:
+    if module.params['state'] != 'facts' and not module.params['host']:
+        module.fail_json(msg="host is required unless state=facts")
+    for proxy_type in module.params['proxy_type'] or []:
+        if proxy_type not in PROXY_TYPES:
+            module.fail_json(msg="proxy_type must be one of: %s" % ', '.join(sorted(PROXY_TYPES)))
+
+    sockets = expand_sockets(module.params['socket'])
+    if not sockets:
         module.fail_json(msg="unable to locate haproxy socket")
 
-    ansible_haproxy = HAProxy(module)
-    ansible_haproxy.act()
+    results = act_on_sockets(module, sockets)
+
+    failed = ['%s: %s' % (path, results[path]['msg']) for path in sockets
+              if results[path].get('failed')]
+    if failed:
+        module.fail_json(msg="; ".join(failed), sockets=results)
+
+    timed_out = ['%s: %s' % (path, ', '.join(results[path]['timed_out']))
+                 for path in sockets if results[path]['timed_out']]
+    if timed_out:
+        module.fail_json(msg="timed out waiting for servers to be %s: %s" %
+                         (module.params['state'], '; '.join(timed_out)),
+                         sockets=results)
+
+    if module.params['state'] == 'facts':
+        if len(sockets) == 1:
+            facts = results[sockets[0]]['facts']
+        else:
+            facts = {'haproxy_sockets': dict([(path, results[path]['facts'])
+                                              for path in sockets])}
+        module.exit_json(changed=False, ansible_facts=facts)
+
+    missing_hosts = []
+    for path in sockets:
+        for host in results[path]['missing_hosts']:
+            if host not in missing_hosts:
+                missing_hosts.append(host)
+
+    module.exit_json(stdout='\n'.join([results[path]['stdout'] for path in sockets
+                                       if results[path]['stdout']]),
+                     missing_hosts=missing_hosts,
+                     changed=bool([path for path in sockets if results[path]['changed']]),
+                     sockets=results)
 
 # import module snippets
 from ansible.module_utils.basic import *